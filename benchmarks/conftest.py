@@ -0,0 +1,48 @@
+"""Benchmarks configuration file."""
+# pylint: disable=redefined-outer-name
+
+import pytest
+
+from bussola_etl_seap.bussola_etl_seap import SEAPBulletin
+from bussola_etl_seap.profiling import StageProfiler
+from bussola_etl_seap.tests.conftest import (  # noqa: F401
+    app_tables, pytest_configure,
+)
+
+from .synthetic import write_bulletin
+
+
+# bulletin sizes, as multiples of the number of facilities in a real one
+SCALES = (1, 10, 100)
+
+
+@pytest.fixture(scope='session', params=SCALES, ids=lambda s: f'{s}x')
+def bulletin_file(request, tmp_path_factory):
+    """Synthetic bulletin file with the SEAP/RJ layout"""
+    path = tmp_path_factory.mktemp('bulletins') / f'{request.param}x.xlsx'
+    return write_bulletin(str(path), scale=request.param)
+
+
+@pytest.fixture(scope='session')
+def bulletin(bulletin_file):
+    """Bulletin parsed from a synthetic file"""
+    return SEAPBulletin(bulletin_file)
+
+
+@pytest.fixture
+def peak_memory(benchmark):
+    """Record the peak memory used by a call in the benchmark results
+
+    Memory is traced in a separate call, so it does not slow down the
+    timed rounds.
+    """
+
+    def measure(func, *args, **kwargs):
+        profiler = StageProfiler(enabled=True)
+        with profiler.stage('call'):
+            func(*args, **kwargs)
+        benchmark.extra_info['peak_memory'] = (
+            profiler.stages['call']['peak_memory']
+        )
+
+    return measure
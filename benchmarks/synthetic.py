@@ -0,0 +1,146 @@
+"""Generator of synthetic SEAP/RJ bulletins for benchmarking."""
+
+import datetime
+import random
+import string
+from typing import List, Optional, Sequence
+
+from openpyxl import Workbook
+
+
+# number of facilities of each kind in a real bulletin (2020-08-11)
+MALE_GROUPS = (9, 9, 8, 15)
+FEMALE_FACILITIES = 5
+SHELTERS = 1
+HOSPITALS = 4
+
+REGIMES = ('Fechado', 'Provisório', 'Semiaberto', 'Aberto', 'Med. de Seg.')
+PLACES = ('Gericinó', 'Japeri', 'Magé', 'Niterói', 'Campos', 'Benfica')
+HEADER = (
+    'ID', 'Nome', 'Localidade', 'Regime', None, 'Original', 'Inóspito',
+    'Cap. Atual', 'Efetivo   Nominal', 'Baixados', 'Acautelado',
+    'Efetivo   Real', 'Excesso', 'Vagas',
+)
+
+
+def _abbreviation(number: int) -> str:
+    """Get a unique, uppercase facility abbreviation for a number"""
+    letters = ''
+    while True:
+        number, remainder = divmod(number, 26)
+        letters = string.ascii_uppercase[remainder] + letters
+        if number == 0:
+            return 'SEAP' + letters
+
+
+def _subtotal(label: str, rows: Sequence[Sequence]) -> List:
+    """Sum the numeric columns of facility rows in a subtotal row"""
+    totals = [
+        sum(row[col] for row in rows if isinstance(row[col], int))
+        for col in range(5, 14)
+    ]
+    return [label, None, None, None, None] + totals
+
+
+class _FacilityWriter:
+    """Produce facility rows with unique ids and merged-cell gaps"""
+
+    def __init__(self, rng: random.Random) -> None:
+        self.rng = rng
+        self.last_id = 0
+
+    def rows(self, name: str, regimes: int = 1) -> List[List]:
+        self.last_id += 1
+        capacity = self.rng.randint(50, 1500)
+        inhospitable = self.rng.choice((0, 0, 0, self.rng.randint(1, 50)))
+        nominal = [self.rng.randint(0, 2000) for _ in range(regimes)]
+        lowered = self.rng.randint(0, 15)
+        custody = self.rng.randint(0, 2)
+        real = sum(nominal) + custody
+        current = capacity - inhospitable
+        rows = [[
+            self.last_id,
+            f'{name} {self.last_id} - {_abbreviation(self.last_id)}',
+            self.rng.choice(PLACES),
+            REGIMES[0],
+            None,
+            capacity,
+            inhospitable,
+            current,
+            nominal[0],
+            lowered,
+            custody,
+            real,
+            max(real - current, 0),
+            max(current - real, 0),
+        ]]
+        # other regimes of the same facility come in rows with merged cells
+        for regime, count in zip(REGIMES[1:], nominal[1:]):
+            rows.append(
+                [None, None, None, regime, None, None, None, None, count] +
+                [None] * 5
+            )
+        return rows
+
+
+def write_bulletin(
+    path: str,
+    scale: int = 1,
+    date: Optional[datetime.date] = None,
+    seed: int = 0,
+) -> str:
+    """Write a bulletin like SEAP/RJ ones, with `scale` times as many units"""
+    rng = random.Random(seed)
+    if date is None:
+        date = datetime.date(2020, 8, 11)
+    facilities = _FacilityWriter(rng)
+    sheet_rows: List[List] = [[], [], [], []]
+    sheet_rows.append([f"EFETIVO CARCERÁRIO DE {date.strftime('%d/%m/%Y')}"])
+    sheet_rows.append(list(HEADER))
+    sheet_rows.extend([[], []])
+    # male prisons, split in groups with their own subtotals
+    for group_size in MALE_GROUPS:
+        group = []
+        for _ in range(group_size * scale):
+            group.extend(
+                facilities.rows('Presídio', regimes=rng.choice((1, 1, 2, 4)))
+            )
+        sheet_rows.extend(group)
+        sheet_rows.append(_subtotal('SUBTOTAL', group))
+    # female prisons
+    sheet_rows.append(['UNIDADES FEMININAS'])
+    group = []
+    for _ in range(FEMALE_FACILITIES * scale):
+        group.extend(
+            facilities.rows('Penitenciária', regimes=rng.choice((1, 3)))
+        )
+    sheet_rows.extend(group)
+    sheet_rows.append(_subtotal('SUBTOTAL', group))
+    # shelters
+    sheet_rows.append(['CASA DO ALBERGARDO'])
+    group = []
+    for _ in range(SHELTERS * scale):
+        group.extend(facilities.rows('Casa do Albergado'))
+        group[-1][1] += ' -MASCULINO'
+    sheet_rows.extend(group)
+    sheet_rows.append(_subtotal('TOTAL REGIME ABERTO', group))
+    # hospitals
+    sheet_rows.append(['UNIDADES HOSPITALARES'])
+    group = []
+    for number in range(HOSPITALS * scale):
+        group.extend(facilities.rows('Hospital Penal'))
+        if number % HOSPITALS == 0:
+            group[-1][1] += ' - FEM'
+    sheet_rows.extend(group)
+    sheet_rows.append(_subtotal('TOTAL HOSPITALAR', group))
+    facility_rows = [
+        row for row in sheet_rows if row and isinstance(row[0], int)
+    ]
+    sheet_rows.append(_subtotal('TOTAL GERAL', facility_rows))
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Efetivo Completo')
+    for row in sheet_rows:
+        sheet.append(row)
+    workbook.create_sheet('Efetivo Simplificado')
+    workbook.save(path)
+    return path
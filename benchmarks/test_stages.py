@@ -0,0 +1,137 @@
+"""Benchmarks for each stage of the ETL pipeline."""
+# pylint: disable=redefined-outer-name,protected-access
+
+import functools
+import pymongo
+import pytest
+
+from bussola_etl_seap import utils
+from bussola_etl_seap.bussola_etl_seap import SEAPBulletin
+from bussola_etl_seap.tests.conftest import FakeDataTable
+
+
+pytest.importorskip('pytest_benchmark')
+mongomock = pytest.importorskip('mongomock')
+
+ROUNDS = 5
+
+
+@pytest.fixture
+def raw_count(bulletin):
+    """Raw custody count sheet of a bulletin, before any parsing"""
+    sheet = bulletin._read_bulletin()
+    return sheet.loc[bulletin.layout.first_data_row:, :]
+
+
+def _parse_bulletin(bulletin_file):
+    """Parse a bulletin and build every table"""
+    bulletin = SEAPBulletin(bulletin_file)
+    return dict(bulletin.tables)
+
+
+def test_parse_bulletin(benchmark, peak_memory, bulletin_file):
+    """Time the whole parsing of a bulletin, from file to every table"""
+    benchmark.pedantic(_parse_bulletin, args=(bulletin_file,), rounds=ROUNDS)
+    peak_memory(_parse_bulletin, bulletin_file)
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'stream'])
+def test_read_bulletin(benchmark, peak_memory, bulletin_file, engine):
+    """Time opening the workbook and reading the custody count sheet"""
+    bulletin = SEAPBulletin(bulletin_file, engine=engine)
+    benchmark.pedantic(
+        bulletin._read_bulletin,
+        setup=bulletin.close,
+        rounds=ROUNDS,
+    )
+    bulletin.close()
+    peak_memory(bulletin._read_bulletin)
+
+
+def test_info_from_subtotals(benchmark, bulletin, raw_count):
+    """Time getting facility types and genders from subtotal rows"""
+    benchmark.pedantic(
+        bulletin._info_from_subtotals,
+        setup=lambda: ((raw_count.copy(),), {}),
+        rounds=ROUNDS,
+    )
+
+
+def test_parse_count(benchmark, peak_memory, bulletin, raw_count):
+    """Time parsing the whole custody count, before splitting it in tables"""
+    benchmark.pedantic(
+        bulletin._parse_count,
+        setup=lambda: ((raw_count.copy(),), {}),
+        rounds=ROUNDS,
+    )
+    peak_memory(bulletin._parse_count, raw_count.copy())
+
+
+@pytest.mark.parametrize('tablename', ['facilities', 'imprisoned'])
+def test_split_count(benchmark, bulletin, tablename):
+    """Time separating a table from the parsed custody count"""
+    benchmark(bulletin._split_count, tablename)
+
+
+def test_get_occupation(benchmark, bulletin):
+    """Time merging capacity and custody counts"""
+    benchmark(
+        bulletin._get_occupation,
+        *(bulletin.tables[tablename] for tablename in (
+            bulletin.table_dependencies['occupation']
+        )),
+    )
+
+
+def test_hash_rows(benchmark, bulletin):
+    """Time hashing every row of the occupation table"""
+    table = bulletin.tables['occupation'].copy()
+    table['registroData'] = bulletin.date.date()
+    benchmark(utils.hash_rows, table)
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'json'])
+def test_to_file(benchmark, peak_memory, bulletin, tmp_path, output_format):
+    """Time exporting a table to a local file"""
+    export = functools.partial(
+        bulletin.to_file,
+        output_file=str(tmp_path / f'bulletin.{output_format}'),
+        tablename='imprisoned',
+        date_col='registroData',
+    )
+    benchmark(export)
+    peak_memory(export)
+
+
+def test_to_anvil(benchmark, peak_memory, bulletin, app_tables):
+    """Time uploading a table to a local fake of Anvil Data Tables"""
+
+    def empty_tables():
+        app_tables.imprisoned = FakeDataTable()
+
+    benchmark.pedantic(
+        bulletin.to_anvil,
+        kwargs=dict(tablename='imprisoned', token='fake-token'),
+        setup=empty_tables,
+        rounds=ROUNDS,
+    )
+    empty_tables()
+    peak_memory(bulletin.to_anvil, tablename='imprisoned', token='fake-token')
+
+
+def test_to_mongo(benchmark, peak_memory, bulletin, monkeypatch):
+    """Time uploading a table to an in-memory MongoDB mock"""
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(pymongo, 'MongoClient', lambda *args, **kw: client)
+    export = functools.partial(
+        bulletin.to_mongo,
+        tablename='imprisoned',
+        connection_string='mongodb://localhost:27017',
+    )
+    benchmark.pedantic(
+        export,
+        setup=lambda: client.drop_database('seap'),
+        rounds=ROUNDS,
+    )
+    client.drop_database('seap')
+    peak_memory(export)
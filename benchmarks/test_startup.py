@@ -0,0 +1,47 @@
+"""Benchmarks for the startup time of the command line tool."""
+# pylint: disable=redefined-outer-name
+
+import subprocess
+import sys
+
+import pytest
+
+
+pytest.importorskip('pytest_benchmark')
+
+ROUNDS = 5
+
+# slow client libraries, imported only by the sinks that use them
+LAZY_MODULES = ('anvil', 'pymongo', 'openpyxl')
+
+
+def _run(*args):
+    """Run Python in a new process, returning its standard output"""
+    return subprocess.run(
+        [sys.executable, *args],
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    ).stdout
+
+
+def test_import(benchmark):
+    """Time importing the package in a new interpreter"""
+    modules = benchmark.pedantic(
+        _run,
+        args=(
+            '-c',
+            'import sys; import bussola_etl_seap.bussola_etl_seap; ' +
+            'print(*sys.modules)',
+        ),
+        rounds=ROUNDS,
+    )
+    imported = {name.split('.')[0] for name in modules.split()}
+    assert not imported & set(LAZY_MODULES)
+
+
+def test_help(benchmark):
+    """Time showing the help of the command line tool"""
+    benchmark.pedantic(
+        _run, args=('-m', 'bussola_etl_seap', '--help'), rounds=ROUNDS,
+    )
@@ -1,6 +1,10 @@
-from pkg_resources import get_distribution, DistributionNotFound
+def __getattr__(name):
+    # resolve the version only when asked, since it is slow to look up
+    if name == '__version__':
+        from importlib.metadata import PackageNotFoundError, version
 
-try:
-    __version__ = get_distribution('BussolaETLSeap').version
-except DistributionNotFound:
-    __version__ = '(local)'
+        try:
+            return version('BussolaETLSeap')
+        except PackageNotFoundError:
+            return '(local)'
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
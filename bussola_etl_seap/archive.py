@@ -0,0 +1,219 @@
+"""Historical store of many bulletins, with time series queries"""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import datetime
+import log
+import pandas as pd
+import sqlite3
+from typing import TYPE_CHECKING, Any, Iterable, List, Optional, Union
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .bussola_etl_seap import SEAPBulletin
+
+
+DateLike = Union[datetime.date, str]
+
+
+def _quote(identifier: str) -> str:
+    """Quote a table or column name for use in SQL statements"""
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _isodate(date: DateLike) -> str:
+    """Format a date as stored in the archive (YYYY-MM-DD)"""
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date[:10])
+    elif isinstance(date, datetime.datetime):
+        date = date.date()
+    return date.isoformat()
+
+
+class BulletinArchive:
+    """SQLite database with the tables of every bulletin ingested
+
+    Each bulletin table is stored in a database table with the same name,
+    with an additional date column. Rows are indexed by date and facility
+    id, so that queries on a week or a facility don't scan the whole
+    history. Ingesting a bulletin again replaces the rows of its date.
+    """
+
+    id_col = 'unidadeId'
+
+    def __init__(self, path: str, date_col: str = 'registroData') -> None:
+        self.path = path
+        self.date_col = date_col
+        # exports may run on a worker thread, one at a time
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+    def close(self) -> None:
+        """Close the connection to the archive database"""
+        self.connection.close()
+
+    def __enter__(self) -> 'BulletinArchive':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _has_table(self, tablename: str) -> bool:
+        """Check whether a table exists in the archive"""
+        return self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (tablename,),
+        ).fetchone() is not None
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        """Dates of the bulletins in the archive"""
+        if not self._has_table('occupation'):
+            return pd.DatetimeIndex([], name=self.date_col)
+        dates = self.connection.execute(
+            f'SELECT DISTINCT {_quote(self.date_col)} FROM occupation ' +
+            f'ORDER BY {_quote(self.date_col)}'
+        ).fetchall()
+        return pd.DatetimeIndex(
+            [date for date, in dates], name=self.date_col,
+        )
+
+    def add(
+        self,
+        bulletin: 'SEAPBulletin',
+        tablenames: Optional[Iterable[str]] = None,
+    ) -> None:
+        """Store tables of a parsed bulletin, replacing its date if needed"""
+        if tablenames is None:
+            tablenames = bulletin.tables.keys()
+        date = _isodate(bulletin.date)
+        log.info(f'Adding bulletin from {date} to archive {self.path}...')
+        # every table of a bulletin is stored, or none is
+        with self.connection:
+            for tablename in tablenames:
+                table = bulletin.tables[tablename].reset_index(drop=True)
+                table[self.date_col] = date
+                if self._has_table(tablename):
+                    self.connection.execute(
+                        f'DELETE FROM {_quote(tablename)} ' +
+                        f'WHERE {_quote(self.date_col)} = ?',
+                        (date,),
+                    )
+                table.to_sql(
+                    tablename,
+                    self.connection,
+                    if_exists='append',
+                    index=False,
+                )
+                self.connection.execute(
+                    'CREATE INDEX IF NOT EXISTS ' +
+                    f'{_quote("ix_" + tablename + "_date_id")} ON ' +
+                    f'{_quote(tablename)} ' +
+                    f'({_quote(self.date_col)}, {_quote(self.id_col)})'
+                )
+                log.debug(f'    Archived {len(table)} {tablename} rows.')
+
+    def _query(self, sql: str, params: Iterable = ()) -> pd.DataFrame:
+        """Run a query, parsing dates in the results"""
+        return pd.read_sql_query(
+            sql,
+            self.connection,
+            params=list(params),
+            parse_dates=[self.date_col],
+        )
+
+    def facility_series(
+        self,
+        facility_id: int,
+        tablename: str = 'occupation',
+        start: Optional[DateLike] = None,
+        end: Optional[DateLike] = None,
+    ) -> pd.DataFrame:
+        """Get rows of a facility in every bulletin, in chronological order"""
+        conditions = [f'{_quote(self.id_col)} = ?']
+        params: List[Any] = [int(facility_id)]
+        if start is not None:
+            conditions.append(f'{_quote(self.date_col)} >= ?')
+            params.append(_isodate(start))
+        if end is not None:
+            conditions.append(f'{_quote(self.date_col)} <= ?')
+            params.append(_isodate(end))
+        return self._query(
+            f'SELECT * FROM {_quote(tablename)} ' +
+            f"WHERE {' AND '.join(conditions)} " +
+            f'ORDER BY {_quote(self.date_col)}',
+            params,
+        )
+
+    def snapshot(
+        self,
+        date: DateLike,
+        tablename: str = 'occupation',
+    ) -> pd.DataFrame:
+        """Get a table from the latest bulletin up to a date"""
+        date_col = _quote(self.date_col)
+        return self._query(
+            f'SELECT * FROM {_quote(tablename)} WHERE {date_col} = (' +
+            f'SELECT MAX({date_col}) FROM {_quote(tablename)} ' +
+            f'WHERE {date_col} <= ?) ' +
+            f'ORDER BY {_quote(self.id_col)}',
+            (_isodate(date),),
+        )
+
+    def top_overcrowded(
+        self,
+        top: int = 10,
+        start: Optional[DateLike] = None,
+        end: Optional[DateLike] = None,
+    ) -> pd.DataFrame:
+        """Get the facilities with most inmates per place, in each bulletin
+
+        Results have the occupation rate (`taxaOcupacao`, inmates divided by
+        current capacity) and the rank of each facility in its bulletin.
+        """
+        date_col = _quote(self.date_col)
+        conditions = ['capacidadeAtual > 0']
+        params: List[Any] = []
+        if start is not None:
+            conditions.append(f'{date_col} >= ?')
+            params.append(_isodate(start))
+        if end is not None:
+            conditions.append(f'{date_col} <= ?')
+            params.append(_isodate(end))
+        params.append(int(top))
+        return self._query(
+            'SELECT * FROM (' +
+            '    SELECT *, RANK() OVER (' +
+            f'        PARTITION BY {date_col} ORDER BY taxaOcupacao DESC' +
+            '    ) AS posicao FROM (' +
+            '        SELECT *, ' +
+            '        CAST(efetivoReal AS REAL) / capacidadeAtual ' +
+            '        AS taxaOcupacao FROM occupation ' +
+            f"        WHERE {' AND '.join(conditions)}" +
+            '    )' +
+            ') WHERE posicao <= ? ' +
+            f'ORDER BY {date_col}, posicao',
+            params,
+        )
+
+    def week_over_week(
+        self,
+        column: str = 'efetivoReal',
+        tablename: str = 'occupation',
+    ) -> pd.DataFrame:
+        """Get the change of a facility value since its previous bulletin
+
+        Changes are in a column with the same name plus 'Variacao'.
+        Facilities with many rows per bulletin (e.g. one per regime) have
+        their values summed before comparing.
+        """
+        date_col = _quote(self.date_col)
+        id_col = _quote(self.id_col)
+        delta_col = _quote(column + 'Variacao')
+        column = _quote(column)
+        return self._query(
+            f'SELECT {date_col}, {id_col}, valor AS {column}, ' +
+            'valor - LAG(valor) OVER (' +
+            f'    PARTITION BY {id_col} ORDER BY {date_col}' +
+            f') AS {delta_col} FROM (' +
+            f'    SELECT {date_col}, {id_col}, SUM({column}) AS valor ' +
+            f'    FROM {_quote(tablename)} GROUP BY {date_col}, {id_col}' +
+            f') ORDER BY {date_col}, {id_col}',
+        )
@@ -1,42 +1,37 @@
 """Classes that model SEAP bulletins and methods to get info from them"""
 # pylint: disable=redefined-outer-name,singleton-comparison
 
-import anvil.server
-import anvil.tables
+import collections
+import concurrent.futures
 import datetime
+import functools
 import hashlib
+import io
+import itertools
 import log
+import numpy as np
 import os
 import pandas as pd
-import pymongo
 import re
-from typing import Mapping, Optional, Tuple, Union
+from . import export, files, layouts, profiling, readers, utils
+from .cache import BulletinCache
+from .export import Checkpoint
+from .layouts import BulletinLayout
+from .tables import LazyTables
+from typing import (
+    TYPE_CHECKING, Any, BinaryIO, Callable, Dict, Iterable, Iterator, Mapping,
+    Optional, Pattern, Tuple, Union,
+)
+
+if TYPE_CHECKING:  # pragma: no cover
+    from . import mongo
 
 
 class SEAPBulletin:
     """Representation of a weekly bulletin from SEAP/RJ"""
 
-    # TODO: colmapping in a separate configuration file
-    # map excel column letters from SEAP/RJ bulletin to desired column names
-    colmapping = {
-        'A': 'unidadeId',
-        'B': 'unidadeNome',
-        'C': 'unidadeLocalidade',
-        'D': 'efetivoRegime',
-        # column E is merged to column D
-        'F': 'capacidadeOriginal',
-        'G': 'capacidadeInospito',
-        'H': 'capacidadeAtual',
-        'I': 'efetivoNominal',
-        'J': 'efetivoBaixados',
-        'K': 'efetivoAcautelado',
-        'L': 'efetivoReal',
-        'M': 'excesso',
-        'N': 'vagas',
-    }
-
     # separate columns by theme
-    # TODO: link to colmapping data structure
+    # TODO: link to layout column mappings
     id_col = 'unidadeId'
     facility_cols = [
         'unidadeNome',
@@ -60,52 +55,206 @@ class SEAPBulletin:
         'efetivoReal',
     ]
 
-    # accepted incarceration types, mapped to their standardized names
-    # TODO: map in a separate file
-    regime_map = {
-        'Aberto': 'Aberto',
-        'Fechado': 'Fechado',
-        'Med. de Seg.': 'Medidas de Segurança',
-        'Provisório': 'Provisório',
-        'Semiaberto': 'Semiaberto',
+    # tables available in every bulletin
+    tablenames = (
+        'facilities',
+        'capacity',
+        'imprisoned',
+        'imprisoned_detail',
+        'occupation',
+    )
+    # tables needed to build other tables
+    table_dependencies = {
+        'occupation': ('facilities', 'capacity', 'imprisoned_detail'),
+    }
+
+    # patterns in facility names that reveal inmates gender; the first
+    # pattern to match sets the category and a cleaned facility name
+    gender_patterns = {
+        'Feminino': re.compile(
+            r'(?P<unidadeNome>.*)[-– ]FEM[INO]*$', flags=re.IGNORECASE,
+        ),
+        'Masculino': re.compile(
+            r'(?P<unidadeNome>.*)[-– ]MASC[ULINO]*$', flags=re.IGNORECASE,
+        ),
     }
+    # pattern separating facility names from their abbreviations
+    abbreviation_patterns = {
+        '_': re.compile(
+            r'^(?P<unidadeNome>[^-–]*)[-–] *(?P<unidadeSigla>[A-Z]*)[-– ]*$'
+        ),
+    }
+
+    # text columns with few distinct values, stored as categories in
+    # compact tables
+    compact_text_cols = facility_cols + ['efetivoRegime', 'efetivoGenero']
+    # ... and in columnar files
+    categorical_cols = [
+        'unidadeNome',
+        'efetivoRegime',
+        'efetivoGenero',
+    ]
+    # capacity and custody counts, stored as small integers in compact tables
+    compact_count_cols = (
+        capacity_cols + imprisoned_detail_cols + ['efetivoNominal']
+    )
+    # ... of which those parsed as floats, as they have gaps in merged cells
+    float_count_cols = capacity_cols + imprisoned_detail_cols
 
     # value for uncertain or not informed diels
     no_info = "Não Informado"
 
-    custody_count_sheet_name = "Efetivo Completo"
-    date_row = 4
+    # stamp for cached parsing results; bump it whenever parsing changes
+    parser_version = '1'
 
     def __init__(
         self,
-        input_file: str,
-        date: Union[datetime.datetime, str, None] = None
+        input_file: Union[str, os.PathLike, bytes, BinaryIO],
+        date: Union[datetime.datetime, str, None] = None,
+        cache: Optional[BulletinCache] = None,
+        engine: str = 'pandas',
+        profile: bool = False,
+        compact: bool = False,
+        layout: Union[str, BulletinLayout, None] = None,
     ) -> None:
         log.info('Initiating bulletin representation...')
+        self._profiler = profiling.StageProfiler(enabled=profile)
+        # use categories and small integers instead of objects and floats
+        self.compact = compact
+        # spreadsheet layout, detected from the workbook if not given
+        if isinstance(layout, str):
+            layout = layouts.get_layout(layout)
+        self._layout: Optional[BulletinLayout] = layout
+        if engine not in readers.ENGINES:
+            log.error(
+                f"Reader engine must be one of {', '.join(readers.ENGINES)}."
+            )
+            raise ValueError
         self.input_file = input_file
-        _custody_count_sheet = self._read_bulletin(
-            sheet_name=self.custody_count_sheet_name,
-        )
+        self.engine = engine
+        self._workbook: Optional[pd.ExcelFile] = None
+        # contents of in-memory inputs (bytes or file-like objects), or of
+        # input files while they are looked up in the cache
+        self._content: Optional[bytes] = None
+        if isinstance(input_file, bytes):
+            self._content = input_file
+        elif not isinstance(input_file, (str, os.PathLike)):
+            self._content = input_file.read()
+        # look for tables parsed from a file with the same contents before
+        cached = None
+        if cache is not None:
+            if self._content is None:
+                # read the file only once, for both hashing and parsing; the
+                # workbook is only opened from it if the lookup misses
+                assert isinstance(input_file, (str, os.PathLike))
+                with open(input_file, 'rb') as infile:
+                    self._content = infile.read()
+            content = self._content
+            # detected layouts depend only on the contents, but others don't
+            cache_key = cache.key(
+                content_hash=hashlib.sha256(content).hexdigest(),
+                parser_version=(
+                    self.parser_version +
+                    ('-compact' if compact else '') +
+                    ('' if layout is None else f'-{layout.name}')
+                ),
+            )
+            with self._profiler.stage('cache'):
+                cached = cache.get(cache_key)
+        # tables are only parsed from the raw custody count when accessed
+        self._raw_count: Optional[pd.DataFrame] = None
+        self._parsed_count: Optional[pd.DataFrame] = None
+        self._unmapped_regimes: Optional[Dict[str, int]] = None
+        builders = {
+            tablename: functools.partial(self._split_count, tablename)
+            for tablename in self.tablenames
+        }
+        # summary table of custody count versus capacity
+        builders['occupation'] = self._get_occupation
+        if (cached is not None) and (
+            (date is not None) or (cached[0] is not None)
+        ):
+            header_date, cached_tables = cached
+            self.tables = LazyTables(
+                builders, self.table_dependencies, tables=cached_tables,
+            )
+        else:
+            # the header date is cached even if a date is given, so that
+            # later runs without one can reuse the entry
+            header_date, self._raw_count = self._extract(
+                date_required=(date is None),
+            )
+            self.tables = LazyTables(builders, self.table_dependencies)
+            if cache is not None:
+                # every table must be built to be stored
+                tables = dict(self.tables)
+                with self._profiler.stage('cache'):
+                    cache.put(cache_key, header_date, tables)
+        # every sheet needed was read already
+        self.close()
         # set date of reference
         if date is not None:
             # from user input
             log.info('Setting bulletin date from user input...')
             if isinstance(date, str):
-                date = datetime.date.fromisoformat(date)
+                date = datetime.datetime.fromisoformat(date)
+            elif not isinstance(date, datetime.datetime):
+                # sinks need a full datetime (e.g. BSON can't encode dates)
+                date = datetime.datetime.combine(date, datetime.time())
             self.date = date
         else:
-            # from bulletin header
-            self.date = self._parse_date(
-                bulletin_sheet=_custody_count_sheet,
-            )
+            # from bulletin header, which is required without a date
+            assert header_date is not None
+            self.date = header_date
         log.info(f'Bulletin date set to {self.date.isoformat()}.')
+
+    def __getstate__(self) -> Dict:
+        # parse the custody count before sending a bulletin to another
+        # process, so that parallel workers do the heavy lifting
+        if self._raw_count is not None:
+            self.parsed_count
+        return self.__dict__
+
+    @property
+    def profile(self) -> Dict[str, Dict[str, float]]:
+        """Calls, wall time, CPU time (in seconds) and peak memory (in bytes)
+        used by each processing stage, if profiling was enabled"""
+        return self._profiler.stages
+
+    @property
+    def layout(self) -> BulletinLayout:
+        """Layout of the bulletin spreadsheet, detected on first use"""
+        if self._layout is None:
+            self._layout = layouts.detect_layout(self.workbook)
+        return self._layout
+
+    @property
+    def _input_name(self) -> str:
+        """Description of the input file, for logging"""
+        if not isinstance(self.input_file, (str, os.PathLike)):
+            # contents of in-memory inputs are kept until the bulletin is gone
+            assert self._content is not None
+            return f'in-memory bulletin ({len(self._content)} bytes)'
+        return str(self.input_file)
+
+    def _extract(
+        self,
+        date_required: bool = True,
+    ) -> Tuple[Optional[datetime.datetime], pd.DataFrame]:
+        """Read the bulletin file and get its header date and raw count"""
+        _custody_count_sheet = self._read_bulletin()
+        header_date = self._parse_date(bulletin_sheet=_custody_count_sheet)
+        if (header_date is None) and date_required:
+            log.error(
+                'No date was found in the bulletin header. Please set the ' +
+                'bulletin date manually.'
+            )
+            raise ValueError
         log.info('Preparing to analyse custody count information...')
         # drop date row and unused column headers
-        _custody_count_raw = _custody_count_sheet.loc[8:, :]
-        # process count info into a usable format
-        self.tables = self._parse_count(_custody_count_raw)
-        # generate summary table of custody count versus capacity
-        self.tables['occupation'] = self._get_occupation()
+        return header_date, _custody_count_sheet.loc[
+            self.layout.first_data_row:, :
+        ]
 
     @classmethod
     def from_sharepoint(
@@ -120,18 +269,39 @@ class SEAPBulletin:
         log.error('Import from SharePoint is not implemented yet!')
         raise NotImplementedError
 
-    def _read_bulletin(
-        self,
-        sheet_name: str,
-    ) -> pd.DataFrame:
+    @property
+    def workbook(self) -> pd.ExcelFile:
+        """Handle to the bulletin workbook, opened once for every sheet"""
+        if self._workbook is None:
+            log.debug('Opening bulletin workbook...')
+            # the stream engine reads through openpyxl, which pandas
+            # doesn't pick for .XLSX files with older xlrd releases
+            excel_engine = 'openpyxl' if self.engine == 'stream' else None
+            if self._content is not None:
+                self._workbook = pd.ExcelFile(
+                    io.BytesIO(self._content), engine=excel_engine,
+                )
+            else:
+                self._workbook = pd.ExcelFile(
+                    self.input_file, engine=excel_engine,
+                )
+        return self._workbook
+
+    def close(self) -> None:
+        """Release the handle to the bulletin workbook, if it is open"""
+        if self._workbook is not None:
+            self._workbook.close()
+            self._workbook = None
+        # contents read from files for the cache can be read again
+        if isinstance(self.input_file, (str, os.PathLike)):
+            self._content = None
+
+    @profiling.profiled('read')
+    def _read_bulletin(self) -> pd.DataFrame:
         """Extracts raw representation of custody count in XSLX bulletin"""
-        log.info(f'Extracting data from {self.input_file}...')
-        bulletin_sheet = pd.read_excel(
-            io=self.input_file,
-            sheet_name=sheet_name,
-            header=None,
-            names=self.colmapping.values(),
-            usecols=','.join(self.colmapping.keys()),
+        log.info(f'Extracting data from {self._input_name}...')
+        bulletin_sheet = readers.ENGINES[self.engine](
+            self.workbook, self.layout,
         )
         bulletin_sheet.index.name = 'id'
         log.info('Data extracted successfully!')
@@ -140,197 +310,324 @@ class SEAPBulletin:
     def _parse_date(
         self,
         bulletin_sheet: pd.DataFrame,
-    ) -> datetime:
-        """Get date from raw bulletin data"""
+    ) -> Optional[datetime.datetime]:
+        """Get date from raw bulletin data, if the header has one"""
         log.debug('Trying to retrieve date from bulletin header...')
-        date_statement = bulletin_sheet.iat[self.date_row, 0]
+        date_statement = bulletin_sheet.at[self.layout.date_row, self.id_col]
         log.debug(f"Found date statement: '{date_statement}'. Parsing...")
-        date_raw = re.search(
-            r'([0-3][0-9]/[0-1][0-9]/20[1-2][0-9])', date_statement
-        ).group(0)
-        date = datetime.datetime.strptime(date_raw, r'%d/%m/%Y')
+        date_match = self.layout.date_pattern.search(str(date_statement))
+        if date_match is None:
+            log.warn('No date was found in the bulletin header.')
+            return None
+        date_raw = date_match.group(0)
+        date = datetime.datetime.strptime(date_raw, self.layout.date_format)
         log.info(f"Date automatically set to {date.isoformat()}.")
         return date
 
+    @property
+    def parsed_count(self) -> pd.DataFrame:
+        """Custody count with facility info in every row, shared by tables"""
+        if self._parsed_count is None:
+            # raw data is handed over to the parser, and not kept here
+            self._parsed_count = self._parse_count(self._take_raw_count())
+        return self._parsed_count
+
+    def _take_raw_count(self) -> pd.DataFrame:
+        """Hand the raw custody count over to the caller, without keeping it"""
+        raw_count, self._raw_count = self._raw_count, None
+        return raw_count
+
     def _parse_count(
         self,
         raw_count: pd.DataFrame
-    ) -> Mapping[str, pd.DataFrame]:
-        """Parse relevant custody count information from raw bulletin data"""
+    ) -> pd.DataFrame:
+        """Parse relevant custody count information from raw bulletin data
+
+        The raw data is modified in place, and should not be used afterwards.
+        """
         log.info('Start parsing raw bulleting data...')
-        parsed = raw_count.copy()
         # parse facility types and inmates gender from subtotals
-        parsed = self._info_from_subtotals(parsed)
-        # fill facility ids in cells that were originally merged in Excel
-        log.info('Filling missing IDs...')
-        parsed['unidadeSigla'] = ""
-        parsed[([self.id_col] + self.facility_cols)] = parsed.loc[
-            :, ([self.id_col] + self.facility_cols)].fillna(
-            method='ffill',
-            axis=0
-        )
-        # leave only rows with valid ids
-        log.info('Deleting rows with subtotals...')
-        parsed[self.id_col] = pd.to_numeric(
-            parsed[self.id_col],
-            errors='coerce'
-        )
-        parsed = parsed.loc[pd.notna(parsed[self.id_col]), :]
-        # complete undefined gender value using patterns in the facility name
-        log.info('Getting additional information from facility name field...')
-        # remove leading and trailing spaces
-        parsed['unidadeNome'] = parsed['unidadeNome'].apply(
-            lambda x: x.strip()
-        )
-        log.debug('    Getting inmates gender...')
-        parsed = parsed.apply(
-            self._info_from_name,
-            axis=1,
-            name_patterns={
-                'Feminino': r'(?P<unidadeNome>.*)[-– ]FEM[INO]*$',
-                'Masculino': r'(?P<unidadeNome>.*)[-– ]MASC[ULINO]*$',
-            },
-            category_col='efetivoGenero',
-            flags=re.IGNORECASE,
-        )
-        # separate name and abbreviation fields
-        log.debug('    Getting facility name abbreviation...')
-        parsed = parsed.apply(
-            self._info_from_name,
-            axis=1,
-            name_patterns={
-                '_': r'^(?P<unidadeNome>[^-–]*)[-–] *' +
-                     r'(?P<unidadeSigla>[A-Z]*)[-– ]*$'
-            },
-        )
-        # remove leading and trailing spaces (again)
-        parsed[['unidadeNome', 'unidadeSigla']] = parsed[
-            ['unidadeNome', 'unidadeSigla']
-        ].applymap(lambda x: x.strip())
+        parsed = self._info_from_subtotals(raw_count)
+        # keep a single reference to the raw data, so that it is released as
+        # soon as rows with subtotals are dropped
+        del raw_count
+        with self._profiler.stage('fill'):
+            # fill facility ids in cells that were originally merged in Excel
+            log.info('Filling missing IDs...')
+            parsed['unidadeSigla'] = ""
+            parsed[([self.id_col] + self.facility_cols)] = parsed.loc[
+                :, ([self.id_col] + self.facility_cols)].fillna(
+                method='ffill',
+                axis=0
+            )
+            # leave only rows with valid ids
+            log.info('Deleting rows with subtotals...')
+            parsed[self.id_col] = pd.to_numeric(
+                parsed[self.id_col],
+                errors='coerce'
+            )
+            # (dropped rather than selecting the others, so that the result
+            # is not a view of the raw data)
+            parsed = parsed.drop(
+                index=parsed.index[pd.isna(parsed[self.id_col])],
+            )
+        with self._profiler.stage('names'):
+            # complete undefined gender value using patterns in facility names
+            log.info(
+                'Getting additional information from facility name field...'
+            )
+            # remove leading and trailing spaces
+            parsed['unidadeNome'] = parsed['unidadeNome'].str.strip()
+            log.debug('    Getting inmates gender...')
+            parsed = self._info_from_name(
+                parsed,
+                name_patterns=self.gender_patterns,
+                category_col='efetivoGenero',
+            )
+            # separate name and abbreviation fields
+            log.debug('    Getting facility name abbreviation...')
+            parsed = self._info_from_name(
+                parsed,
+                name_patterns=self.abbreviation_patterns,
+            )
+            # raw columns mixed header text and numbers; infer proper dtypes
+            # now that only facility rows are left
+            parsed = parsed.infer_objects()
+            # remove leading and trailing spaces (again)
+            parsed['unidadeNome'] = parsed['unidadeNome'].str.strip()
+            parsed['unidadeSigla'] = parsed['unidadeSigla'].str.strip()
         # TODO: complete facility types using patterns in their names (??)
-        # standardize regime types
-        parsed['efetivoRegime'] = parsed['efetivoRegime'].apply(
-            self._parse_regimes
-        )
+        with self._profiler.stage('regimes'):
+            # standardize regime types
+            parsed['efetivoRegime'] = self._parse_regimes(
+                parsed['efetivoRegime']
+            )
         # make sure facility id column is integer
         parsed[self.id_col] = parsed[self.id_col].astype(int)
-        # separate facility data, imprisoned and capacity DataFrames
-        log.info('Separating retrieved data...')
-        facilities = parsed.loc[:, [self.id_col] + self.facility_cols]
-        capacity = parsed.loc[:, [self.id_col] + self.capacity_cols]
-        imprisoned = parsed.loc[:, [self.id_col] + self.imprisoned_cols]
-        imprisoned_detail = parsed.loc[
-            :,
-            [self.id_col] + self.imprisoned_detail_cols
-        ]
-        log.info('Droping empty rows...')
-        # discard duplicates from merged cells
-        facilities = facilities.dropna().drop_duplicates()
-        capacity = capacity.dropna().drop_duplicates()
-        imprisoned_detail = imprisoned_detail.dropna().drop_duplicates()
         log.info('Successfully parsed custody count!')
+        return parsed
+
+    @profiling.profiled('split')
+    def _split_count(self, tablename: str) -> pd.DataFrame:
+        """Separate facility, capacity or inmates data from parsed count"""
+        log.info(f'Separating {tablename} data...')
+        theme_cols = {
+            'facilities': self.facility_cols,
+            'capacity': self.capacity_cols,
+            'imprisoned': self.imprisoned_cols,
+            'imprisoned_detail': self.imprisoned_detail_cols,
+        }[tablename]
+        table = self.parsed_count.loc[:, [self.id_col] + theme_cols]
+        if tablename != 'imprisoned':
+            # discard empty rows and duplicates from merged cells
+            table = table.dropna().drop_duplicates()
+        if self.compact:
+            table = self._compact_dtypes(table)
+        return table
+
+    def _compact_dtypes(self, table: pd.DataFrame) -> pd.DataFrame:
+        """Convert text columns to categories and counts to small integers"""
+        return utils.compact_dtypes(
+            table,
+            id_col=self.id_col,
+            text_cols=self.compact_text_cols,
+            count_cols=self.compact_count_cols,
+            categories=self._categories,
+        )
+
+    @property
+    def _categories(self) -> Dict[str, pd.CategoricalDtype]:
+        """Categories of the text columns whose values the layout sets"""
+        sections = self.layout.count_sections.values()
+        values = {
+            'efetivoRegime': list(self.layout.regime_map.values()),
+            'efetivoGenero': list(self.gender_patterns) + [
+                section['efetivoGenero'] for section in sections
+                if 'efetivoGenero' in section
+            ],
+            'unidadeTipo': [
+                section['unidadeTipo'] for section in sections
+                if 'unidadeTipo' in section
+            ],
+        }
         return {
-            'facilities': facilities,
-            'capacity': capacity,
-            'imprisoned': imprisoned,
-            'imprisoned_detail': imprisoned_detail,
+            col: pd.CategoricalDtype(sorted({self.no_info, *col_values}))
+            for col, col_values in values.items()
         }
 
+    def dated(
+        self,
+        tablename: str,
+        date_col: str = 'registroData',
+    ) -> pd.DataFrame:
+        """Get a table with an additional column for the bulletin date
+
+        The original columns are shared with the stored table, not copied.
+        In compact bulletins, dates are stored as `datetime64` values
+        instead of `datetime.date` objects.
+        """
+        table = self.tables[tablename].copy(deep=False)
+        if self.compact:
+            table[date_col] = pd.Timestamp(self.date.date())
+        else:
+            table[date_col] = self.date.date()
+        return table
+
+    def iter_records(
+        self,
+        tablename: str,
+        chunksize: int = 1000,
+        date_col: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield the rows of a table as dicts of native Python values
+
+        Rows are converted `chunksize` at a time, as they are consumed.
+        With a `date_col`, records also have the bulletin date (see
+        `dated`).
+        """
+        if date_col is None:
+            table = self.tables[tablename]
+        else:
+            table = self.dated(tablename, date_col)
+        return utils.iter_records(table, chunksize)
+
+    @profiling.profiled('subtotals')
     def _info_from_subtotals(
         self,
         count_with_subtotals: pd.DataFrame,
     ) -> pd.DataFrame:
-        """Get facility types and inmates gender from bulletin subtotals"""
+        """Get facility types and inmates gender from bulletin subtotals
+
+        Columns are added to the given DataFrame in place.
+        """
         log.info('Extracting information custody count subtotals...')
-        # get position of main subtotals
-        title_fem_id = count_with_subtotals.loc[
-            count_with_subtotals[self.id_col] == 'UNIDADES FEMININAS', :
-        ].index.values[0]
-        title_shelter_id = count_with_subtotals.loc[
-            count_with_subtotals[self.id_col] == 'CASA DO ALBERGARDO', :
-        ].index.values[0]
-        title_hosp_id = count_with_subtotals.loc[
-            count_with_subtotals[self.id_col] == 'UNIDADES HOSPITALARES', :
-        ].index.values[0]
-        # set facility type and gender based on position relative to subtotals
-        parsed_count = count_with_subtotals.copy()
+        parsed_count = count_with_subtotals
+        markers = self.layout.section_markers
+        count_sections = self.layout.count_sections
+        # find the headers of every section in a single pass over the ids,
+        # normalizing each distinct text only once
+        ids = parsed_count[self.id_col].to_numpy()
+        text_rows = np.flatnonzero([isinstance(value, str) for value in ids])
+        text_sections: Dict[str, str] = {}
+        for text in set(ids[text_rows]):
+            section = markers.get(layouts.normalize_header(text))
+            if section is not None:
+                text_sections[text] = section
+        marker_rows = [row for row in text_rows if ids[row] in text_sections]
+        sections = [self.layout.first_count_section] + [
+            text_sections[ids[row]] for row in marker_rows
+        ]
+        missing = [
+            section for section in count_sections
+            if section not in sections
+        ]
+        if len(missing) > 0:
+            log.warn(
+                f"No headers of sections {', '.join(missing)} were found. " +
+                'Their facilities are counted in the previous sections.'
+            )
+        # facilities belong to the section of the last header above them
+        row_sections = np.searchsorted(
+            marker_rows, np.arange(len(ids)), side='right',
+        )
         log.info(
             'Setting facility types and inmate genders based on subtotals...'
         )
-        # prison-like facilities - set facility type as 'Not Informed'
-        parsed_count.loc[:title_shelter_id, 'unidadeTipo'] = self.no_info
-        # male prisons
-        parsed_count.loc[:title_fem_id, 'efetivoGenero'] = 'Masculino'
-        # female prisons
-        fem_prison_ids = range(title_fem_id, title_shelter_id)
-        parsed_count.loc[fem_prison_ids, 'efetivoGenero'] = 'Feminino'
-        # shelters
-        shelter_ids = range(title_shelter_id, title_hosp_id)
-        parsed_count.loc[shelter_ids, 'unidadeTipo'] = 'Casa do Albergado'
-        # hospitals
-        parsed_count.loc[
-            title_hosp_id:, 'unidadeTipo'
-        ] = 'Hospital de Custódia e Tratamento Psiquiatrico'
-        # shelters and hospitals don't inform the custody count by gender
-        parsed_count.loc[:, 'efetivoGenero'].fillna(
-            self.no_info,
-            inplace=True,
-        )
+        for col in ('unidadeTipo', 'efetivoGenero'):
+            section_values = np.array(
+                [
+                    count_sections[section].get(col, self.no_info)
+                    for section in sections
+                ],
+                dtype=object,
+            )
+            parsed_count[col] = section_values[row_sections]
         # return modified DataFrame
         log.info('Successfully extracted information from subtotals!')
         return parsed_count
 
     @staticmethod
     def _info_from_name(
-        row: pd.Series,
-        name_patterns: Mapping[str, str],
+        parsed: pd.DataFrame,
+        name_patterns: Mapping[str, Pattern],
         category_col: Optional[str] = None,
-        **kwargs,
-    ) -> Union[pd.Series, Tuple[str], str]:
+    ) -> pd.DataFrame:
         """Get info based on text patterns in facility name field"""
-        # if none of the patterns match, return target original values
-        log.debug(f"Extracting information for '{row['unidadeNome']}'...")
+        # names that did not match any of the patterns keep original values
+        pending = pd.Series(True, index=parsed.index)
         for category, pattern in name_patterns.items():
-            log.debug(f"Searching regex '{pattern}' in '{row['unidadeNome']}'")
-            # check given pattern
-            match = re.search(pattern, row['unidadeNome'], **kwargs)
-            if match:
-                log.debug('    MATCHED!')
-                # set column with matched category (if provided)
-                if category_col is not None:
-                    log.debug(f'    {category_col} set to {category}')
-                    row[category_col] = category
-                # map captured groups to columns with the same name
-                for col, value in match.groupdict().items():
-                    row[col] = value
-                # if pattern matches, stop searching
-                break
-        return row
-
-    def _parse_regimes(self, regime_raw: str):
-        """Map original regime types to standardized values"""
-        try:
-            regime = self.regime_map[regime_raw]
-        except KeyError:
-            regime = self.no_info
-        finally:
-            return regime
-
-    def _get_occupation(self):
+            log.debug(f"Searching regex '{pattern.pattern}' in names...")
+            extracted = parsed.loc[pending, 'unidadeNome'].str.extract(
+                pattern,
+            )
+            # a name matched if any of the named groups captured something
+            matched = extracted.index[extracted.notna().any(axis=1)]
+            log.debug(f'    {len(matched)} names matched.')
+            # set column with matched category (if provided)
+            if category_col is not None:
+                parsed.loc[matched, category_col] = category
+            # map captured groups to columns with the same name
+            for col in extracted.columns:
+                parsed.loc[matched, col] = extracted.loc[matched, col]
+            # if a pattern matches, stop searching for that name
+            pending[matched] = False
+        return parsed
+
+    def _parse_regimes(self, regimes_raw: pd.Series) -> pd.Series:
+        """Map original regime types to standardized values
+
+        Types not in the `regime_map` of the layout are set as not informed,
+        and counted in `unmapped_regimes`.
+        """
+        regimes = regimes_raw.map(self.layout.regime_map)
+        self._unmapped_regimes = {
+            str(regime): int(count)
+            for regime, count in regimes_raw[regimes.isna()].value_counts(
+                dropna=False,
+            ).items()
+        }
+        if len(self._unmapped_regimes) > 0:
+            log.warn(
+                f"Unknown regime types set as '{self.no_info}': " +
+                ', '.join(
+                    f"'{regime}' ({count} rows)"
+                    for regime, count in self._unmapped_regimes.items()
+                )
+            )
+        return regimes.fillna(self.no_info)
+
+    @property
+    def unmapped_regimes(self) -> Optional[Dict[str, int]]:
+        """Regime types not in the layout `regime_map`, with row counts
+
+        Types are counted when the custody count is parsed, so bulletins
+        loaded from a cache don't have them (None).
+        """
+        if self._raw_count is not None:
+            self.parsed_count
+        return self._unmapped_regimes
+
+    @profiling.profiled('occupation')
+    def _get_occupation(
+        self,
+        facilities: pd.DataFrame,
+        capacity: pd.DataFrame,
+        imprisoned_detail: pd.DataFrame,
+    ) -> pd.DataFrame:
         """Get comparison between facilities capacity and number of inmates"""
         joined = pd.merge(
-            self.tables['capacity'].groupby(self.id_col).sum(),
-            self.tables['imprisoned_detail'].groupby(self.id_col).sum(),
+            capacity.groupby(self.id_col).sum(),
+            imprisoned_detail.groupby(self.id_col).sum(),
             on='unidadeId',
             validate="1:1",
         )
         joined = pd.merge(
-            self.tables['facilities'],
+            facilities,
             joined,
             on='unidadeId',
             validate='1:1',
         )
-        return joined[
+        occupation = joined[
             [
                 'unidadeId',
                 'unidadeNome',
@@ -339,91 +636,85 @@ class SEAPBulletin:
                 'efetivoReal',
             ]
         ]
+        if self.compact:
+            # sums of counts may be upcast by the merges
+            occupation = self._compact_dtypes(occupation)
+        return occupation
 
-    @staticmethod
-    def _get_row_hash(row: pd.Series,) -> str:
-        """Get the SHA256 hash for the json equivalent of a pandas record"""
-        row_bytes = row.to_json(orient='records').encode()
-        digest = hashlib.sha256(row_bytes).hexdigest()
-        return digest
-
+    @profiling.profiled('export:file:{tablename}')
     def to_file(
         self,
         output_file: str,
         # TODO: deal with user-specified formats
         tablename: Union[str],
         date_col: Optional[str] = None,
-        mode: str = 'w',
+        exist_policy: str = 'overwrite',
         orient: str = 'records',
-        # TODO: write mode (append, overwrite, fail)
+        compression: Optional[str] = None,
+        partition: bool = False,
         **kwargs,
     ) -> None:
-        """Export bulletin tables as a local CSV or JSON file"""
+        """Export bulletin tables as a local CSV, JSON, Parquet or Feather file
+
+        Parquet and Feather files can be partitioned by bulletin date, in
+        Hive-style folders such as `<output>/<table>/<date_col>=YYYY-MM-DD/`.
+
+        If the output already exists, `exist_policy` sets whether to 'fail',
+        'overwrite' it, 'append' new rows or 'upsert' only rows whose
+        facility id and date were not written before. Upserts check a
+        sidecar index of written keys instead of reading the output again.
+        Parquet and Feather outputs can only be appended to if partitioned.
+        """
         log.info('Preparing to export...')
-        # deal with export path and extension
-        log.debug('    Parsing output file name...')
-        try:
-            output_basepath, output_format = re.match(
-                r'^(.*)\.([a-z]+)$',
-                output_file,
-                flags=re.IGNORECASE,
-            ).group(1, 2)
-        except ValueError:
-            output_basepath = output_file
-            output_format = 'csv'  # TODO: use user-specified format, if given
-        # replace [YYYY], [MM] and [DD] in output file name by bulletin date
-        output_basepath = re.sub(
-            r'\[YYYY\]',
-            str(self.date.year),
-            output_basepath
-        )
-        output_basepath = re.sub(
-            r'\[MM\]',
-            str(self.date.month).zfill(2),
-            output_basepath
+        output = files.TableOutput(
+            output_file,
+            tablename,
+            date=self.date.date(),
+            date_col=date_col,
+            partition=partition,
         )
-        output_basepath = re.sub(
-            r'\[DD\]',
-            str(self.date.day).zfill(2),
-            output_basepath
-        )
-        # TODO: check and deal with appending and overwriting existing files
-        # Get requested table
+        appending = output.check_policy(exist_policy, orient=orient)
         log.debug(f"    Retrieving input table '{tablename}'")
-        table = self.tables[tablename].copy()
-        # add date column, if given
+        keys: Optional[pd.Series] = None
+        key_cols = [self.id_col]
         if date_col is not None:
             log.debug('    Adding date column...')
-            table[date_col] = self.date.date()
-        # export
-        log.debug('    Starting export...')
-        outfile_path = (
-            output_basepath + '_' + tablename + '.' + output_format
+            table = self.dated(tablename, date_col=date_col)
+            key_cols.append(date_col)
+            keys = files.table_keys(table, key_cols)
+        else:
+            table = self.tables[tablename].copy(deep=False)
+        # leave out rows written before (upserts always have a date column)
+        if (exist_policy == 'upsert') and (keys is not None):
+            is_new = ~keys.isin(output.written_keys(key_cols=key_cols))
+            log.info(
+                f'Skipping {(~is_new).sum()} rows that were written before.'
+            )
+            table = table.loc[is_new, :]
+            keys = keys.loc[is_new]
+            if len(table) == 0:
+                log.info(f'No new rows to export to {output.path}.')
+                return
+        if output.columnar:
+            # repeated texts are stored once, as dictionary-encoded columns
+            table = table.astype({
+                col: 'category'
+                for col in self.categorical_cols
+                if col in table.columns
+            })
+        output.write(
+            table,
+            appending=appending,
+            index_col=self.id_col,
+            orient=orient,
+            compression=compression,
+            **kwargs
         )
-        with open(outfile_path, mode, encoding='utf-8') as outfile:
-            if output_format == 'csv':
-                # replace temporary index
-                table.set_index(self.id_col, inplace=True)
-                # export csv
-                table.to_csv(outfile, mode=mode, **kwargs)
-            elif output_format == 'json':
-                # export json
-                table.to_json(
-                    outfile,
-                    orient=orient,
-                    indent=4,
-                    force_ascii=False,
-                    **kwargs
-                )
-            else:
-                log.error(
-                    f"Can not export to '{output_format.upper()}' format."
-                )
-                raise RuntimeError
+        output.update_index(keys, exist_policy, appending=appending)
         log.debug(f'    Exported {tablename} table successfully!')
         log.info('Successfully exported files!')
 
-    @anvil.server.callable
+    @profiling.profiled('export:anvil:{tablename}')
     def to_anvil(
         self,
         tablename: str,
@@ -432,17 +723,37 @@ class SEAPBulletin:
         exist_policy: str = 'ignore',
         date_col: str = "registroData",
         hash_col: str = 'registroSHA256',
+        chunksize: int = 500,
+        checkpoint: Optional[Checkpoint] = None,
     ) -> bool:
-        """Export table to an Anvil app Data Table """
+        """Export table to an Anvil app Data Table
+
+        With a `checkpoint`, rows committed by a previous upload of the same
+        table are skipped, and the checkpoint is updated after each batch.
+        """
         log.info('Preparing to upload to Anvil app...')
-        # get the input DataFrame by name
+        if exist_policy not in ('fail', 'ignore', 'force'):
+            log.error(
+                "Policy for existing records must be one of 'fail'" +
+                " 'ignore', or 'force'."
+            )
+            raise AttributeError
+        # get the input DataFrame by name, sharing its columns
         log.debug(f"    Retrieving input table '{tablename}'")
-        table = self.tables[tablename].copy()
+        table = self.tables[tablename]
+        if (checkpoint is not None) and (checkpoint.rows > 0):
+            log.info(f'    Resuming after {checkpoint.rows} rows uploaded...')
+            table = table.iloc[checkpoint.rows:]
+        table = table.copy(deep=False)
         # add date and unique id fields
         log.debug('    Writing date column...')
         table[date_col] = self.date.date()
         log.debug('    Generating unique ID...')
-        table[hash_col] = table.apply(self._get_row_hash, axis=1)
+        with self._profiler.stage('hashing'):
+            # compact tables are hashed as parsed, so that ids don't change
+            table[hash_col] = utils.hash_rows(
+                utils.expand_dtypes(table, self.float_count_cols),
+            )
         # get uplink token from ANVIL_TOKEN env variable, if not provided
         if token is None:
             try:
@@ -459,8 +770,8 @@ class SEAPBulletin:
                 )
                 raise RuntimeError
         # connect to anvil app
-        log.debug('    Connecting to Anvil App...')
-        anvil.server.connect(token)
+        uplink = export.get_backend('anvil')
+        uplink.connect(token)
         # if destination DataTable name was not informed,
         # set it as the same as the input DataFrame name
         if (output_table == '') or (output_table is None):
@@ -471,63 +782,48 @@ class SEAPBulletin:
             output_table = tablename
         # check whether destination DataTable exists in the app, and alias it
         log.debug('    Fetching destination DataTable...')
-        outtable = getattr(anvil.tables.app_tables, output_table, False,)
-        if outtable is False:
-            log.error(f"There is no table named '{output_table}' in this app!")
-            raise AttributeError
-        # export rows one by one to destination DataTable
-        log.info('Starting export...')
-        warn_duplicates = False
-        for record in table.to_dict(orient='records'):
-            log.debug(f'Exporting row with ID {record[hash_col]}...')
-            existing_row = outtable.get(**{hash_col: record[hash_col]})
-            if (existing_row is not None) and (exist_policy == 'fail'):
-                log.debug(
-                    f'Record {record[hash_col]} (facility id #' +
-                    f'{record[hash_col]}) already exist in destination.')
-                log.error(
-                    'One or more records already exist in the destination! ' +
-                    'Aborting...'
-                )
-                raise ValueError
-            elif (existing_row is not None) and (exist_policy == 'ignore'):
-                warn_duplicates = True
-                log.debug(
-                    f'Record {record[hash_col]} (facility id #' +
-                    f'{record[hash_col]}) already exist in destination.')
-                continue
-            elif (existing_row is None) or (exist_policy == 'force'):
-                warn_duplicates = True
-                outtable.add_row(**record)
-            else:
-                log.error(
-                    "Policy for existing records must be one of 'fail'" +
-                    " 'ignore', or 'force'."
-                )
-                raise AttributeError
-        if warn_duplicates is True:
-            log.warn(
-                'Duplicated records were found and handled according ' +
-                'to the policy for existent records. Check Anvil panel or ' +
-                'run this tool again with --debug option to see the repeated' +
-                ' records.'
-            )
+        outtable = uplink.get_table(output_table)
+        uplink.upload(
+            table,
+            outtable=outtable,
+            date=self.date.date(),
+            date_col=date_col,
+            hash_col=hash_col,
+            id_col=self.id_col,
+            exist_policy=exist_policy,
+            chunksize=chunksize,
+            checkpoint=checkpoint,
+        )
         log.info('Successfully uploaded data to Anvil!')
         return True
 
+    @profiling.profiled('export:mongo:{tablename}')
     def to_mongo(
         self,
         tablename: str,
-        connection_string: str,
-        database: str,
+        connection_string: Optional[str] = None,
+        database: str = 'seap',
         date_col: str = 'registroData',
         exist_policy: str = 'ignore',
-    ) -> None:
-        """Export table to a MongoDB instance."""
+        chunksize: int = 1000,
+        loader: Optional['mongo.MongoLoader'] = None,
+        checkpoint: Optional[Checkpoint] = None,
+    ) -> 'mongo.LoadSummary':
+        """Export table to a MongoDB instance.
+
+        Pass an open `loader` to reuse its pooled connection; otherwise a
+        temporary one is opened with the connection string and closed after
+        the upload. With a `checkpoint`, rows committed by a previous upload
+        of the same table are skipped, and it is updated after each chunk.
+        """
         log.info('Preparing to upload to MongoDB...')
-        # get the input DataFrame by name
+        # get the input DataFrame by name, sharing its columns
         log.debug(f"    Retrieving input table '{tablename}'")
-        table = self.tables[tablename].copy()
+        table = self.tables[tablename]
+        if (checkpoint is not None) and (checkpoint.rows > 0):
+            log.info(f'    Resuming after {checkpoint.rows} rows uploaded...')
+            table = table.iloc[checkpoint.rows:]
+        table = table.copy(deep=False)
         # add date and unique id fields
         log.debug('    Writing date and source columns...')
         table[date_col] = self.date
@@ -536,57 +832,111 @@ class SEAPBulletin:
             'Janeiro'
         )
         log.debug('    Generating unique ID...')
-        table["_id"] = table[[self.id_col, date_col, 'registroFonte']].apply(
-            self._get_row_hash,
-            axis=1,
-        )
-        try:
-            log.info('Starting connection...')
-            log.debug(connection_string)
-            client = pymongo.MongoClient(
-                connection_string,
-                serverSelectionTimeoutMS=3000,  # 3 second timeout
+        with self._profiler.stage('hashing'):
+            table["_id"] = utils.hash_rows(
+                table[[self.id_col, date_col, 'registroFonte']],
             )
-            log.debug('Connection established.')
-            db = client[database]
-            collection = db[tablename]
-            log.debug('Starting upload...')
-            warn_duplicates = False
-            for record in table.to_dict(orient='records'):
-                # check for duplicates
-                existing_doc = collection.find_one({'_id': record['_id']})
-                if existing_doc is not None:
-                    # handles duplicate
-                    warn_duplicates = True
-                    log.debug(f"Record {record['_id']} already exists.")
-                    if exist_policy == 'fail':
-                        log.error(
-                            'One or more records already exist in the ' +
-                            'destination and exist_policy is  ' +
-                            'Aborting...'
-                        )
-                        raise ValueError
-                    elif exist_policy == 'update':
-                        collection.update_one(record)
-                    elif exist_policy == 'ignore':
-                        continue
-                    else:
-                        log.error(
-                            'Policy for existing records must be one of ' +
-                            "'fail', 'ignore', or 'force'."
-                        )
-                        raise ValueError
-                else:
-                    # if there are no duplicates, proceed and insert value
-                    collection.insert_one(record)
-            if warn_duplicates is True:
-                log.warn(
-                    'Duplicated records were found and handled according ' +
-                    'to the policy for existent records. Check Anvil panel ' +
-                    'or run this tool again with --debug option to see the ' +
-                    'repeated records.'
+        if loader is None:
+            if connection_string is None:
+                log.error(
+                    'Either a MongoDB connection string or an open loader ' +
+                    'must be provided.'
                 )
-            log.info('Finished uploading data to MongoDB.')
-        except pymongo.errors.ServerSelectionTimeoutError as err:
-            log.error("MongoDB ERROR: ", err)
-            raise
+                raise ValueError
+            mongo = export.get_backend('mongo')
+            with mongo.MongoLoader(connection_string, database) as loader:
+                return loader.load_table(
+                    tablename, table, exist_policy, chunksize, checkpoint,
+                )
+        return loader.load_table(
+            tablename, table, exist_policy, chunksize, checkpoint,
+        )
+
+
+def _try_parse(
+    parse_bulletin: Callable[[str], SEAPBulletin],
+    input_file: str,
+) -> Union[SEAPBulletin, Exception]:
+    """Parse a bulletin, returning the error instead of raising it"""
+    try:
+        return parse_bulletin(input_file)
+    except Exception as error:  # pylint: disable=broad-except
+        return error
+
+
+def parse_bulletins(
+    input_files: Iterable[str],
+    workers: int = 1,
+    on_error: Optional[Callable[[str, Exception], None]] = None,
+    **kwargs,
+) -> Iterator[SEAPBulletin]:
+    """Parse many bulletins, optionally in parallel, yielding them in order
+
+    If `on_error` is given, files that can't be parsed are logged, skipped
+    and passed to it with their error, so that the other bulletins are
+    still parsed; otherwise, the first error is raised. Other keyword
+    arguments are passed to the `SEAPBulletin` constructor.
+    """
+    input_files = list(input_files)
+    parse_bulletin = functools.partial(
+        _try_parse, functools.partial(SEAPBulletin, **kwargs),
+    )
+    if (workers <= 1) or (len(input_files) <= 1):
+        log.info(f'Parsing {len(input_files)} bulletin(s) sequentially...')
+        yield from _skip_errors(
+            input_files, map(parse_bulletin, input_files), on_error,
+        )
+        return
+    log.info(
+        f'Parsing {len(input_files)} bulletins with {workers} workers...'
+    )
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+    ) as executor:
+        # results are yielded as soon as they are ready, in input order, so
+        # the caller can export a bulletin while the next ones are parsed
+        results = _parse_ahead(
+            executor, parse_bulletin, input_files, window=2 * workers,
+        )
+        yield from _skip_errors(input_files, results, on_error)
+
+
+def _parse_ahead(
+    executor: concurrent.futures.Executor,
+    parse_bulletin: Callable[[str], Union[SEAPBulletin, Exception]],
+    input_files: Iterable[str],
+    window: int,
+) -> Iterator[Union[SEAPBulletin, Exception]]:
+    """Parse files in an executor, yielding the results in input order
+
+    At most `window` files are parsed ahead of the last result yielded, so
+    that parsed bulletins don't pile up in memory while the caller is slower
+    than the workers.
+    """
+    remaining = iter(input_files)
+    futures = collections.deque(
+        executor.submit(parse_bulletin, input_file)
+        for input_file in itertools.islice(remaining, window)
+    )
+    while len(futures) > 0:
+        result = futures.popleft().result()
+        next_file = next(remaining, None)
+        if next_file is not None:
+            futures.append(executor.submit(parse_bulletin, next_file))
+        yield result
+
+
+def _skip_errors(
+    input_files: Iterable[str],
+    results: Iterable[Union[SEAPBulletin, Exception]],
+    on_error: Optional[Callable[[str, Exception], None]],
+) -> Iterator[SEAPBulletin]:
+    """Yield parsed bulletins, reporting the files that failed"""
+    for input_file, result in zip(input_files, results):
+        if isinstance(result, Exception):
+            if on_error is None:
+                raise result
+            log.error(f'Failed to parse {input_file}: {result!r}')
+            on_error(input_file, result)
+            continue
+        yield result
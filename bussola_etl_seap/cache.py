@@ -0,0 +1,121 @@
+"""On-disk cache of parsed bulletins, keyed by the contents of input files"""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import datetime
+import json
+import log
+import os
+import pandas as pd
+import shutil
+import tempfile
+from typing import Dict, Mapping, Optional, Tuple
+
+
+class BulletinCache:
+    """Directory of parsed bulletin tables, stored as Feather files
+
+    Each entry is a folder named after the parser version and the SHA-256
+    of the original input file, with one Feather file per table and a
+    metadata file with the bulletin date. Entries are evicted in least
+    recently used order once the cache grows over `max_size` bytes.
+    """
+
+    meta_file = 'meta.json'
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_size: int = 512 * 2**20,  # 512 MB
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(content_hash: str, parser_version: str) -> str:
+        """Get the cache key for an input file parsed by a parser version"""
+        return f'v{parser_version}-{content_hash}'
+
+    def get(
+        self,
+        key: str,
+    ) -> Optional[Tuple[Optional[datetime.datetime], Dict[str, pd.DataFrame]]]:
+        """Load the date and tables of a cached bulletin, if there is one"""
+        entry_dir = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(entry_dir, self.meta_file)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        except FileNotFoundError:
+            log.debug(f'Cache miss for {key}.')
+            return None
+        log.info(f'Loading parsed bulletin from cache ({key})...')
+        tables = {}
+        for tablename, index_name in meta['tables'].items():
+            table = pd.read_feather(
+                os.path.join(entry_dir, tablename + '.feather')
+            )
+            table = table.set_index(table.columns[0])
+            table.index.name = index_name
+            tables[tablename] = table
+        date = meta['date']
+        if date is not None:
+            date = datetime.datetime.fromisoformat(date)
+        # mark entry as recently used
+        os.utime(meta_path)
+        return date, tables
+
+    def put(
+        self,
+        key: str,
+        date: Optional[datetime.datetime],
+        tables: Mapping[str, pd.DataFrame],
+    ) -> None:
+        """Store the date and tables of a parsed bulletin"""
+        log.debug(f'Storing parsed bulletin in cache ({key})...')
+        entry_dir = os.path.join(self.cache_dir, key)
+        # write to a temporary folder first, so that concurrent processes
+        # never read an incomplete entry
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+        try:
+            for tablename, table in tables.items():
+                table.reset_index().to_feather(
+                    os.path.join(tmp_dir, tablename + '.feather')
+                )
+            meta = {
+                'date': None if date is None else date.isoformat(),
+                'tables': {
+                    tablename: table.index.name
+                    for tablename, table in tables.items()
+                },
+            }
+            with open(
+                os.path.join(tmp_dir, self.meta_file), 'w', encoding='utf-8',
+            ) as meta_file:
+                json.dump(meta, meta_file)
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # another process may have stored the same entry meanwhile
+            log.debug(f'Could not store {key} in cache.')
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self._evict()
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until the cache fits its size"""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, key, self.meta_file)
+            if not os.path.isfile(meta_path):
+                continue
+            entry_dir = os.path.join(self.cache_dir, key)
+            size = sum(
+                entry.stat().st_size for entry in os.scandir(entry_dir)
+            )
+            entries.append((os.path.getmtime(meta_path), size, entry_dir))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            log.debug(f'Evicting {entry_dir} from cache...')
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
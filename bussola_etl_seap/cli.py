@@ -3,22 +3,73 @@
 
 import datetime
 import click
+import functools
+import hashlib
+import json
 import log
 import os 
 
-from typing import Optional, Tuple
-from bussola_etl_seap import bussola_etl_seap
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from bussola_etl_seap import bussola_etl_seap, utils
+from bussola_etl_seap.archive import BulletinArchive
+from bussola_etl_seap.cache import BulletinCache
+from bussola_etl_seap.export import (
+    Checkpoint, ExportScheduler, Sink, get_backend,
+)
+from bussola_etl_seap.manifest import IngestionManifest
+
+if TYPE_CHECKING:  # pragma: no cover
+    from bussola_etl_seap import mongo
 
 
 # TODO: chain subcommands for extract, transform and load
 
 
 @click.command()
-@click.option(  # TODO: allow multiple inputs
+@click.option(
     '-i',
     '--input-file',
     required=True,
-    help='File path, if local; or URL, if remote',
+    help='File path, if local; or URL, if remote. A directory or a glob ' +
+    'pattern (e.g. "./data/input/2020*.xlsx") processes every .XLSX ' +
+    'bulletin found in it.',
+)
+@click.option(
+    '--workers',
+    default=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help='Number of processes used to parse bulletins in parallel, when ' +
+    'more than one input file is given.',
+)
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False, writable=True, resolve_path=True),
+    help='Directory where parsed bulletins are cached. Bulletins with the ' +
+    'same contents as a cached one are not parsed again.',
+)
+@click.option(
+    '--cache-size',
+    default=512,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help='Maximum size of the cache directory, in megabytes. Least ' +
+    'recently used bulletins are removed when it grows over this size.',
+)
+@click.option(
+    '--engine',
+    default='pandas',
+    type=click.Choice(['pandas', 'stream']),
+    show_default=True,
+    help='Engine used to read the bulletin sheets. "stream" reads only the ' +
+    'rows and columns with custody counts, and is faster for .XLSX files.',
+)
+@click.option(
+    '--layout',
+    type=str,
+    help='Name of the spreadsheet layout of the bulletins (e.g. ' +
+    '"seap-2020"). By default, the layout of each bulletin is detected ' +
+    'from its headers.',
 )
 @click.option(
     '--date',
@@ -38,7 +89,22 @@ from bussola_etl_seap import bussola_etl_seap
     '-o',
     '--output-file',
     type=click.Path(writable=True, dir_okay=False, resolve_path=True),
-    help='Path and name of the output file.'
+    help='Path and name of the output file. Extensions .csv, .json, ' +
+    '.parquet and .feather are accepted.'
+)
+@click.option(
+    '--partition',
+    default=False,
+    is_flag=True,
+    help='Write Parquet and Feather files in folders partitioned by ' +
+    'table and bulletin date, such as ' +
+    '"<output>/occupation/registroData=2020-08-11/part.parquet".',
+)
+@click.option(
+    '--compression',
+    type=str,
+    help='Compression of Parquet and Feather files. By default, uses ' +
+    '"snappy" for Parquet and "lz4" for Feather.',
 )
 @click.option(  # TODO: accept multiple
     '--to-anvil-table',
@@ -64,19 +130,81 @@ from bussola_etl_seap import bussola_etl_seap
     help='Database to which parsed data will be loaded, when exporting to a ' +
          'MongoDB instance.',
 )
+@click.option(
+    '--mongo-pool-size',
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+    help='Maximum number of simultaneous connections to the MongoDB ' +
+         'instance, shared by every exported table and bulletin.',
+)
+@click.option(
+    '--sink-workers',
+    type=click.IntRange(min=1),
+    default=2,
+    show_default=True,
+    help='Maximum number of tables uploaded at the same time to each ' +
+         'Anvil app or MongoDB instance. Local files and the archive ' +
+         'receive one table at a time. Every destination is loaded ' +
+         'concurrently with the others.',
+)
+@click.option(
+    '--retries',
+    type=click.IntRange(min=0),
+    default=3,
+    show_default=True,
+    help='Number of times an upload is retried after losing the ' +
+         'connection to a destination. Retries resume from the last batch ' +
+         'of rows committed.',
+)
+@click.option(
+    '--retry-backoff',
+    type=click.FloatRange(min=0),
+    default=1.0,
+    show_default=True,
+    help='Seconds to wait before the first retry of an upload. The wait ' +
+         'doubles after each failed retry.',
+)
+@click.option(
+    '--to-archive',
+    type=click.Path(writable=True, dir_okay=False, resolve_path=True),
+    help='Path of a SQLite database that keeps the tables of every ' +
+    'bulletin processed, for historical queries.',
+)
 @click.option(
     '--date-column',
     default='registroData',
     type=str,
     help='Name of the column with bulletin date, in the exported file.'
 )
-@click.option(  # TODO: other policies
+@click.option(
+    '--if-exists',
+    type=click.Choice(['fail', 'overwrite', 'append', 'upsert']),
+    help='What to do if the output file already exists: raise an error ' +
+    '(default), overwrite it, append new rows to it or append only the ' +
+    'rows whose facility id and date were not written before (upsert).',
+)
+@click.option(
     '-a',
     '--append',
     default=False,
     is_flag=True,
     help='If output file already exists, should append newlines to it? '
-    + 'If not and file exists, raises an error.',
+    + 'If not and file exists, raises an error. Same as --if-exists append.',
+)
+@click.option(
+    '--manifest',
+    type=click.Path(writable=True, dir_okay=False, resolve_path=True),
+    help='Path of a file that records which tables of each bulletin were ' +
+    'loaded to each destination. Bulletins already loaded (with the same ' +
+    '--date and --layout) are skipped, and only the destinations that ' +
+    'failed before are retried.',
+)
+@click.option(
+    '--profile',
+    type=click.Path(writable=True, dir_okay=False, resolve_path=True),
+    help='Path of a file to which the wall time, CPU time and peak memory ' +
+    'of each processing stage are appended, as JSON lines.',
 )
 @click.option(
     '--verbosity',
@@ -88,15 +216,30 @@ from bussola_etl_seap import bussola_etl_seap
 )
 def etl(
     input_file: str,
+    workers: int,
+    cache_dir: Optional[str],
+    cache_size: int,
+    engine: str,
+    layout: Optional[str],
     date: datetime,
     export_table: Tuple[str],
     output_file: Optional[str],
+    partition: bool,
+    compression: Optional[str],
     to_anvil_table: Optional[str],
     anvil_token: Optional[str],
     to_mongo: Optional[str],
     mongo_dbname: str,
+    mongo_pool_size: int,
+    sink_workers: int,
+    retries: int,
+    retry_backoff: float,
+    to_archive: Optional[str],
     date_column: str,
+    if_exists: Optional[str],
     append: Optional[bool],
+    manifest: Optional[str],
+    profile: Optional[str],
     verbosity: int,
 ) -> None:
     """Get info from a SEAP/RJ bulletin saved as a local .XLSX file"""
@@ -105,45 +248,293 @@ def etl(
     log.init(verbosity=verbosity)
     # TODO: deal with files in SharePoint
     # TODO: deal with files in e-mail
-    # TODO: deal with multiple input files or files in directory
-    bulletin = bussola_etl_seap.SEAPBulletin(
-        input_file=input_file,
-        date=date,
-    )
-    # process 'all' is present
+    input_files = utils.find_bulletin_files(input_file)
+    if len(input_files) == 0:
+        log.error(f"No bulletin files were found in '{input_file}'.")
+        raise click.BadParameter(
+            'no bulletin files found', param_hint='--input-file',
+        )
+    if (date is not None) and (len(input_files) > 1):
+        log.error('A single --date can not be set for multiple bulletins.')
+        raise click.BadParameter(
+            'can only be used with a single input file', param_hint='--date',
+        )
+    if if_exists is None:
+        if_exists = 'append' if append else 'fail'
     if export_table == 'all':
-        export_table = bulletin.tables.keys()
+        tablenames = list(bussola_etl_seap.SEAPBulletin.tablenames)
     else:
-        # TODO: replace with real handler for multiple files
-        export_table = [export_table]
+        # TODO: accept a list of table names
+        tablenames = [export_table]
+    # open a single pooled connection to MongoDB for the whole run
+    mongo_loader = None
+    if to_mongo is not None:
+        mongo_loader = get_backend('mongo').MongoLoader(
+            connection_string=to_mongo,
+            database=mongo_dbname,
+            pool_size=mongo_pool_size,
+        )
+    archive = None
+    if to_archive is not None:
+        archive = BulletinArchive(to_archive, date_col=date_column)
+    try:
+        sinks = _get_sinks(
+            output_file=output_file,
+            partition=partition,
+            compression=compression,
+            to_anvil_table=to_anvil_table,
+            anvil_token=anvil_token,
+            to_mongo=to_mongo,
+            mongo_loader=mongo_loader,
+            archive=archive,
+            date_column=date_column,
+            if_exists=if_exists,
+        )
+        # check which bulletins were loaded to every sink before, with the
+        # options that change their records
+        ingestion_manifest = None
+        parse_options = {
+            'date': None if date is None else date.isoformat(),
+            'layout': layout,
+        }
+        pending: Dict[str, Tuple[Optional[str], Dict[str, List[str]]]] = {
+            input_file: (None, {sink: tablenames for sink in sinks})
+            for input_file in input_files
+        }
+        if manifest is not None:
+            ingestion_manifest = IngestionManifest(manifest)
+            parser_version = bussola_etl_seap.SEAPBulletin.parser_version
+            pending = {}
+            for input_file in input_files:
+                file_hash = ingestion_manifest.content_hash(input_file)
+                pending_sinks = ingestion_manifest.pending(
+                    file_hash,
+                    parser_version=parser_version,
+                    sinks=sinks,
+                    tablenames=tablenames,
+                    options=parse_options,
+                )
+                if len(pending_sinks) == 0:
+                    log.info(f'Skipping {input_file}, loaded already.')
+                    continue
+                pending[input_file] = (file_hash, pending_sinks)
+            # keep fingerprints of files hashed for the first time
+            ingestion_manifest.save()
+        cache = None
+        if cache_dir is not None:
+            cache = BulletinCache(cache_dir, max_size=cache_size * 2**20)
+        # a bulletin that fails doesn't stop the others, but fails the run
+        failed_files = []
+        bulletins = bussola_etl_seap.parse_bulletins(
+            input_files=pending.keys(),
+            workers=workers,
+            on_error=lambda input_file, _: failed_files.append(input_file),
+            date=date,
+            cache=cache,
+            engine=engine,
+            layout=layout,
+            profile=(profile is not None),
+        )
+        # network sinks can take more than one table at a time
+        scheduler = ExportScheduler(
+            sinks,
+            concurrency={
+                sink: sink_workers
+                for sink in sinks
+                if sink.startswith(('anvil:', 'mongo:'))
+            },
+            retries=retries,
+            backoff=retry_backoff,
+        )
+        with scheduler:
+            for bulletin in bulletins:
+                # bulletins of the CLI are always parsed from file paths
+                bulletin_file = str(bulletin.input_file)
+                content_hash, pending_sinks = pending[bulletin_file]
+                on_done = get_checkpoint = None
+                if (ingestion_manifest is not None) and (
+                    content_hash is not None
+                ):
+                    on_done = functools.partial(
+                        _mark_done,
+                        ingestion_manifest,
+                        content_hash,
+                        parse_options,
+                        bulletin,
+                    )
+                    # resume uploads interrupted in previous runs
+                    get_checkpoint = functools.partial(
+                        _get_checkpoint,
+                        ingestion_manifest,
+                        content_hash,
+                        parse_options,
+                        bulletin,
+                    )
+                try:
+                    scheduler.export(
+                        bulletin,
+                        pending_sinks,
+                        on_done=on_done,
+                        get_checkpoint=get_checkpoint,
+                    )
+                except Exception as error:  # pylint: disable=broad-except
+                    log.error(f'Failed to export {bulletin_file}: {error!r}')
+                    failed_files.append(bulletin_file)
+                    continue
+                if profile is not None:
+                    _write_profile(bulletin, profile)
+        scheduler.log_summary()
+        if len(failed_files) > 0:
+            log.error(
+                f'{len(failed_files)} bulletins failed: ' +
+                ', '.join(failed_files)
+            )
+        if scheduler.failed > 0:
+            log.error(f'{scheduler.failed} table exports failed.')
+        if (len(failed_files) > 0) or (scheduler.failed > 0):
+            raise RuntimeError
+    finally:
+        if mongo_loader is not None:
+            mongo_loader.close()
+        if archive is not None:
+            archive.close()
+
+
+def _fingerprint(secret: str) -> str:
+    """Identify a credential in the manifest without storing it"""
+    return hashlib.sha256(secret.encode('utf-8')).hexdigest()[:12]
+
+
+def _get_sinks(
+    output_file: Optional[str],
+    partition: bool,
+    compression: Optional[str],
+    to_anvil_table: Optional[str],
+    anvil_token: Optional[str],
+    to_mongo: Optional[str],
+    mongo_loader: Optional['mongo.MongoLoader'],
+    archive: Optional[BulletinArchive],
+    date_column: str,
+    if_exists: str,
+) -> Dict[str, Sink]:
+    """Get functions that export a bulletin table to each requested sink
+
+    Sinks are identified by their kind and destination, so that tables
+    already loaded to them can be tracked between runs. Network sinks
+    resume from the checkpoint they are given.
+    """
+    sinks = {}
     # export to local files
     # TODO: refactor to accept a directory path and export all inside it
     if output_file is not None:
-        for table in export_table:
+        sinks[f'file:{output_file}'] = lambda bulletin, table, _: (
             bulletin.to_file(
                 output_file=output_file,
                 tablename=table,
                 date_col=date_column,
+                partition=partition,
+                compression=compression,
+                exist_policy=if_exists,
             )
+        )
     # export to Anvil
     if (to_anvil_table is not None) or (anvil_token is not None):
-        for table in export_table:
-            bulletin.to_anvil(
+        # tables are named per app, so tell apps apart by their token
+        app = _fingerprint(anvil_token or os.environ.get('ANVIL_TOKEN', ''))
+        sinks[f'anvil:{app}/{to_anvil_table or ""}'] = (
+            lambda bulletin, table, checkpoint: bulletin.to_anvil(
                 tablename=table,
                 output_table=to_anvil_table,
                 token=anvil_token,
                 date_col=date_column,
+                checkpoint=checkpoint,
             )
-
+        )
     # export to MongoDB
-    if to_mongo is not None:
-        for table in export_table:
-            bulletin.to_mongo(
+    if (mongo_loader is not None) and (to_mongo is not None):
+        # connection strings may have passwords; keep only a fingerprint
+        server = _fingerprint(to_mongo)
+        sinks[f'mongo:{server}/{mongo_loader.database.name}'] = (
+            lambda bulletin, table, checkpoint: bulletin.to_mongo(
                 tablename=table,
-                connection_string=to_mongo,
-                database=mongo_dbname,
                 date_col=date_column,
+                loader=mongo_loader,
+                checkpoint=checkpoint,
             )
+        )
+    # add to historical archive
+    if archive is not None:
+        sinks[f'archive:{archive.path}'] = lambda bulletin, table, _: (
+            archive.add(bulletin, tablenames=[table])
+        )
+    return sinks
+
+
+def _mark_done(
+    ingestion_manifest: IngestionManifest,
+    content_hash: str,
+    parse_options: Dict[str, Any],
+    bulletin: bussola_etl_seap.SEAPBulletin,
+    sink: str,
+    tablename: str,
+) -> None:
+    """Record in the manifest that a sink received a bulletin table"""
+    ingestion_manifest.mark_done(
+        content_hash,
+        parser_version=bulletin.parser_version,
+        sink=sink,
+        tablename=tablename,
+        input_file=str(bulletin.input_file),
+        date=bulletin.date,
+        options=parse_options,
+    )
+
+
+def _get_checkpoint(
+    ingestion_manifest: IngestionManifest,
+    content_hash: str,
+    parse_options: Dict[str, Any],
+    bulletin: bussola_etl_seap.SEAPBulletin,
+    sink: str,
+    tablename: str,
+) -> Checkpoint:
+    """Get the progress of an upload, persisted in the manifest"""
+    return Checkpoint(
+        rows=ingestion_manifest.progress(
+            content_hash,
+            bulletin.parser_version,
+            sink,
+            tablename,
+            options=parse_options,
+        ),
+        on_commit=functools.partial(
+            ingestion_manifest.save_progress,
+            content_hash,
+            bulletin.parser_version,
+            sink,
+            tablename,
+            options=parse_options,
+        ),
+    )
+
+
+def _write_profile(
+    bulletin: bussola_etl_seap.SEAPBulletin,
+    profile_file: str,
+) -> None:
+    """Append the resources used by each stage of a bulletin as JSON lines"""
+    log.info(f'Writing profile of processing stages to {profile_file}...')
+    date = None if bulletin.date is None else bulletin.date.isoformat()
+    with open(profile_file, 'a', encoding='utf-8') as outfile:
+        for stage, stats in bulletin.profile.items():
+            record = dict(
+                bulletin=str(bulletin.input_file),
+                date=date,
+                stage=stage,
+                **stats,
+            )
+            outfile.write(json.dumps(record) + '\n')
+
 
 if __name__ == '__main__':  # pragma: no cover
     etl()
@@ -0,0 +1,247 @@
+"""Concurrent export of bulletin tables to many destinations"""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import concurrent.futures
+import importlib
+import log
+import sys
+import time
+from types import ModuleType
+from typing import (
+    TYPE_CHECKING, Any, Callable, Dict, List, Mapping, Optional, Sequence,
+    Tuple, Type,
+)
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .bussola_etl_seap import SEAPBulletin
+
+
+# errors of lost or slow connections, after which exports are retried;
+# backends add the ones raised by their client libraries
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError)
+
+# modules with the client of each kind of network sink, by sink kind. Their
+# client libraries are slow to import, so they are only imported when a
+# sink of their kind is used
+BACKENDS = {
+    'anvil': 'uplink',
+    'mongo': 'mongo',
+}
+
+
+def get_backend(kind: str) -> ModuleType:
+    """Import the module with the client of a kind of sink, on first use"""
+    if kind not in BACKENDS:
+        log.error(
+            f"Unknown kind of sink '{kind}'. Known kinds are " +
+            f"{', '.join(BACKENDS)}."
+        )
+        raise ValueError
+    return importlib.import_module(f'.{BACKENDS[kind]}', __package__)
+
+
+def transient_errors() -> Tuple[Type[BaseException], ...]:
+    """Get the transient errors, with those of the backends imported so far
+
+    Backends that were never imported can't have raised errors yet.
+    """
+    errors = TRANSIENT_ERRORS
+    for module in BACKENDS.values():
+        backend = sys.modules.get(f'{__package__}.{module}')
+        if backend is not None:
+            errors += backend.TRANSIENT_ERRORS
+    return errors
+
+
+class Checkpoint:
+    """Number of rows of a table already committed to a sink
+
+    Sinks that load tables in chunks skip the rows committed before and
+    commit each chunk as soon as it is written, so that an interrupted
+    export resumes from the chunk that failed. `on_commit` is called with
+    the total committed so far, to persist it between runs.
+    """
+
+    def __init__(
+        self,
+        rows: int = 0,
+        on_commit: Optional[Callable[[int], None]] = None,
+    ) -> None:
+        self.rows = rows
+        self.on_commit = on_commit
+
+    def commit(self, rows: int) -> None:
+        """Record that more rows were written to the sink"""
+        self.rows += rows
+        if self.on_commit is not None:
+            self.on_commit(self.rows)
+
+
+# function that exports a table of a bulletin to a destination
+Sink = Callable[['SEAPBulletin', str, Checkpoint], Any]
+
+
+class SinkSummary:
+    """Tables exported to a sink, failures and time spent exporting"""
+
+    def __init__(self) -> None:
+        self.exported = 0
+        self.failed = 0
+        self.retries = 0
+        self.busy_time = 0.0
+        # input file, table name and exception of each failed export
+        self.errors: List[Tuple[str, str, BaseException]] = []
+
+    def __repr__(self) -> str:
+        return (
+            f'SinkSummary(exported={self.exported}, failed={self.failed}, ' +
+            f'retries={self.retries}, busy_time={self.busy_time:.3f})'
+        )
+
+
+class ExportScheduler:
+    """Export the tables of each bulletin to every sink at once
+
+    Every sink has its own thread pool, so that slow or failing
+    destinations don't hold back the others, and at most `concurrency`
+    tables are exported to it at the same time (one by default, which
+    keeps tables in order). A bulletin takes as long as its slowest sink.
+
+    Exports that fail with transient errors (such as lost connections) are
+    retried up to `retries` times, waiting `backoff` seconds before the
+    first retry and twice as long before each of the next ones. Retries
+    resume from the last chunk committed. Exports that still fail are
+    logged and counted in the sink summary, without stopping the others.
+    """
+
+    def __init__(
+        self,
+        sinks: Mapping[str, Sink],
+        concurrency: Optional[Mapping[str, int]] = None,
+        retries: int = 0,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ) -> None:
+        self.sinks = dict(sinks)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        concurrency = concurrency or {}
+        self.summary: Dict[str, SinkSummary] = {
+            sink: SinkSummary() for sink in self.sinks
+        }
+        self._executors = {
+            sink: concurrent.futures.ThreadPoolExecutor(
+                max_workers=concurrency.get(sink, 1),
+                thread_name_prefix=f'export-{sink.split(":", 1)[0]}',
+            )
+            for sink in self.sinks
+        }
+
+    def __enter__(self) -> 'ExportScheduler':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Wait for running exports and release the threads of every sink"""
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+
+    @property
+    def failed(self) -> int:
+        """Number of exports that failed, in every sink"""
+        return sum(summary.failed for summary in self.summary.values())
+
+    def _run(
+        self,
+        sink: str,
+        bulletin: 'SEAPBulletin',
+        tablename: str,
+        checkpoint: Checkpoint,
+    ) -> Tuple[float, int]:
+        """Export a table to a sink, returning the time and retries taken"""
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                self.sinks[sink](bulletin, tablename, checkpoint)
+                break
+            except transient_errors() as error:
+                if attempt == self.retries:
+                    raise
+                delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                log.warn(
+                    f"Exporting table '{tablename}' to {sink} failed with " +
+                    f'{error!r}. Retrying in {delay:.1f}s, after ' +
+                    f'{checkpoint.rows} rows committed...'
+                )
+                time.sleep(delay)
+        return time.perf_counter() - start, attempt
+
+    def export(
+        self,
+        bulletin: 'SEAPBulletin',
+        pending_sinks: Mapping[str, Sequence[str]],
+        on_done: Optional[Callable[[str, str], None]] = None,
+        get_checkpoint: Optional[Callable[[str, str], Checkpoint]] = None,
+    ) -> None:
+        """Export tables of a bulletin to sinks, waiting until all finish
+
+        `pending_sinks` maps sink names to the tables they should receive.
+        `on_done` is called with the sink and table name of every
+        successful export, in the calling thread, as soon as it finishes.
+        `get_checkpoint` gets the progress of each export from a previous
+        run, given the same arguments; by default, exports start over.
+        """
+        # tables are built lazily, and that is not safe to do concurrently
+        for tablename in {
+            tablename
+            for sink_tables in pending_sinks.values()
+            for tablename in sink_tables
+        }:
+            bulletin.tables[tablename]
+        futures = {
+            self._executors[sink].submit(
+                self._run,
+                sink,
+                bulletin,
+                tablename,
+                Checkpoint() if get_checkpoint is None
+                else get_checkpoint(sink, tablename),
+            ): (sink, tablename)
+            for sink, sink_tables in pending_sinks.items()
+            for tablename in sink_tables
+        }
+        input_file = str(bulletin.input_file)
+        for future in concurrent.futures.as_completed(futures):
+            sink, tablename = futures[future]
+            summary = self.summary[sink]
+            error = future.exception()
+            if error is not None:
+                log.error(
+                    f"Failed to export table '{tablename}' of " +
+                    f'{input_file} to {sink}: {error!r}'
+                )
+                summary.failed += 1
+                summary.errors.append((input_file, tablename, error))
+                continue
+            busy_time, retries = future.result()
+            summary.exported += 1
+            summary.busy_time += busy_time
+            summary.retries += retries
+            if on_done is not None:
+                on_done(sink, tablename)
+
+    def log_summary(self) -> None:
+        """Log the number of tables exported to each sink"""
+        for sink, summary in self.summary.items():
+            message = (
+                f'{sink}: {summary.exported} tables exported in ' +
+                f'{summary.busy_time:.1f}s ({summary.retries} retries), ' +
+                f'{summary.failed} failed.'
+            )
+            if summary.failed > 0:
+                log.warn(message)
+            else:
+                log.info(message)
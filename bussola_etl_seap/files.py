@@ -0,0 +1,351 @@
+"""Helpers to write bulletin tables to local files incrementally"""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import datetime
+import glob
+import log
+import os
+import pandas as pd
+import re
+from typing import Iterable, List, Mapping, Optional, Sequence, Set
+
+
+# what to do when an output file already exists
+EXIST_POLICIES = ('fail', 'overwrite', 'append', 'upsert')
+
+# binary, columnar file formats, with their default compression
+COLUMNAR_FORMATS = {
+    'parquet': 'snappy',
+    'feather': 'lz4',
+}
+# formats tables can be exported to, by file extension
+FILE_FORMATS = ('csv', 'json') + tuple(COLUMNAR_FORMATS)
+
+
+def table_keys(table: pd.DataFrame, key_cols: Sequence[str]) -> pd.Series:
+    """Get a text key for each row of a table, joining its key columns"""
+    keys = table[key_cols[0]].astype(str)
+    for col in key_cols[1:]:
+        keys = keys + '|' + table[col].astype(str)
+    return keys
+
+
+def read_written_keys(
+    paths: Iterable[str],
+    output_format: str,
+    key_cols: Sequence[str],
+    date_col: Optional[str] = None,
+    partition_values: Optional[Mapping[str, object]] = None,
+) -> Set[str]:
+    """Read the keys of the rows in output files written before"""
+    partition_values = partition_values or {}
+    file_cols = [col for col in key_cols if col not in partition_values]
+    keys: Set[str] = set()
+    for path in paths:
+        log.debug(f'    Reading keys of rows already written to {path}...')
+        if output_format == 'csv':
+            written = pd.read_csv(path, usecols=file_cols)
+        elif output_format == 'json':
+            written = pd.read_json(path, orient='records', convert_dates=False)
+            written = written.reindex(columns=file_cols)
+        else:
+            written = getattr(pd, 'read_' + output_format)(
+                path, columns=file_cols,
+            )
+        for col, value in partition_values.items():
+            written[col] = value
+        if (date_col is not None) and (len(written) > 0):
+            # JSON files store dates as epoch milliseconds
+            unit = 'ms' if pd.api.types.is_numeric_dtype(
+                written[date_col]
+            ) else None
+            written[date_col] = pd.to_datetime(
+                written[date_col], unit=unit,
+            ).dt.date
+        keys.update(table_keys(written, key_cols))
+    return keys
+
+
+class KeysIndex:
+    """Sidecar file with the keys of every row written to an output
+
+    Keys are stored one per line, so that new keys can be appended and
+    checked without reading the output files themselves.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    @property
+    def exists(self) -> bool:
+        """Whether the index file was created already"""
+        return os.path.isfile(self.path)
+
+    def load(self) -> Set[str]:
+        """Read every key in the index"""
+        with open(self.path, 'r', encoding='utf-8') as index_file:
+            return set(index_file.read().splitlines())
+
+    def add(self, keys: Iterable[str]) -> None:
+        """Append keys to the index"""
+        with open(self.path, 'a', encoding='utf-8') as index_file:
+            index_file.writelines(key + '\n' for key in keys)
+
+    def reset(self, keys: Iterable[str]) -> None:
+        """Replace every key in the index"""
+        with open(self.path, 'w', encoding='utf-8') as index_file:
+            index_file.writelines(key + '\n' for key in keys)
+
+
+def append_json_records(path: str, records_json: str) -> None:
+    """Add records to the JSON array in a file, without rewriting it
+
+    `records_json` must be a JSON array of records, formatted with the
+    same indentation as the file contents.
+    """
+    body = records_json.strip()[1:-1].strip()
+    if body == '':
+        return
+    with open(path, 'r+b') as outfile:
+        size = outfile.seek(0, os.SEEK_END)
+        tail_start = outfile.seek(max(size - 4096, 0))
+        tail = outfile.read().rstrip()
+        if not tail.endswith(b']'):
+            log.error(f'{path} does not end with a JSON array.')
+            raise ValueError
+        # position right after the last element (or the opening bracket)
+        before_end = tail[:-1].rstrip()
+        if before_end.endswith(b'['):
+            separator = '\n    '
+        else:
+            separator = ',\n    '
+        outfile.seek(tail_start + len(before_end))
+        outfile.truncate()
+        outfile.write((separator + body + '\n]').encode('utf-8'))
+
+
+def _fill_date(path: str, date: datetime.date) -> str:
+    """Replace [YYYY], [MM] and [DD] in a path by the parts of a date"""
+    path = path.replace('[YYYY]', str(date.year))
+    path = path.replace('[MM]', str(date.month).zfill(2))
+    return path.replace('[DD]', str(date.day).zfill(2))
+
+
+class TableOutput:
+    """Local file to which a bulletin table is exported
+
+    The format is given by the extension of `output_file` (CSV, if it has
+    none), and [YYYY], [MM] and [DD] in it are replaced by the bulletin
+    date. Each table goes to `<output>_<table>.<format>`, or, if
+    `partition` is set, to Hive-style folders such as
+    `<output>/<table>/<date_col>=YYYY-MM-DD/`.
+    """
+
+    def __init__(
+        self,
+        output_file: str,
+        tablename: str,
+        date: datetime.date,
+        date_col: Optional[str] = None,
+        partition: bool = False,
+    ) -> None:
+        log.debug('    Parsing output file name...')
+        output_match = re.match(
+            r'^(.*)\.([a-z]+)$', output_file, flags=re.IGNORECASE,
+        )
+        if output_match is not None:
+            basepath, output_format = output_match.group(1, 2)
+            self.format = output_format.lower()
+        else:
+            basepath = output_file
+            self.format = 'csv'  # TODO: use user-specified format, if given
+        if self.format not in FILE_FORMATS:
+            log.error(f"Can not export to '{self.format.upper()}' format.")
+            raise RuntimeError
+        if partition and not self.columnar:
+            log.error(
+                'Only Parquet and Feather files can be partitioned by date.'
+            )
+            raise ValueError
+        if partition and (date_col is None):
+            log.error('A date column is needed to partition exported files.')
+            raise ValueError
+        self.date = date
+        self.date_col = date_col
+        self.partition = partition
+        basepath = _fill_date(basepath, date)
+        # look for previous outputs
+        self.existing_files: List[str] = []
+        if partition:
+            self.partition_dir = os.path.join(
+                basepath, tablename, f'{date_col}={date.isoformat()}',
+            )
+            os.makedirs(self.partition_dir, exist_ok=True)
+            self.existing_files = sorted(glob.glob(
+                os.path.join(self.partition_dir, 'part*.' + self.format)
+            ))
+            self.path = os.path.join(self.partition_dir, 'part.' + self.format)
+            # files starting with '_' are ignored by dataset readers
+            self.keys_index = KeysIndex(
+                os.path.join(self.partition_dir, '_keys'),
+            )
+        else:
+            self.path = f'{basepath}_{tablename}.{self.format}'
+            if os.path.isfile(self.path):
+                self.existing_files = [self.path]
+            self.keys_index = KeysIndex(self.path + '.keys')
+
+    @property
+    def columnar(self) -> bool:
+        """Whether the output is in a binary, columnar format"""
+        return self.format in COLUMNAR_FORMATS
+
+    def check_policy(self, exist_policy: str, orient: str = 'records') -> bool:
+        """Check what to do with existing outputs, returning if appending"""
+        if exist_policy not in EXIST_POLICIES:
+            log.error(
+                "Policy for existing files must be one of " +
+                f"{', '.join(EXIST_POLICIES)}."
+            )
+            raise ValueError
+        if (exist_policy == 'upsert') and (self.date_col is None):
+            log.error('A date column is needed to upsert rows to files.')
+            raise ValueError
+        if len(self.existing_files) == 0:
+            return False
+        if exist_policy == 'fail':
+            log.error(
+                f"{self.path} already exists and exist_policy is " +
+                "'fail'. Aborting..."
+            )
+            raise ValueError
+        appending = exist_policy in ('append', 'upsert')
+        if appending and self.columnar and not self.partition:
+            log.error(
+                'Parquet and Feather files can only be appended to when ' +
+                'partitioned by date.'
+            )
+            raise ValueError
+        if appending and (self.format == 'json') and (orient != 'records'):
+            log.error("Only JSON files with 'records' can be appended to.")
+            raise ValueError
+        return appending
+
+    def written_keys(self, key_cols: Sequence[str]) -> Set[str]:
+        """Get the keys of the rows written before, indexing them if needed
+
+        Indexes left behind by outputs that were removed are discarded.
+        """
+        if self.keys_index.exists and (len(self.existing_files) > 0):
+            return self.keys_index.load()
+        if self.keys_index.exists:
+            log.info(f'Discarding index of removed output {self.path}...')
+        else:
+            log.info('Indexing rows written before...')
+        written_keys = read_written_keys(
+            self.existing_files,
+            output_format=self.format,
+            key_cols=key_cols,
+            date_col=self.date_col,
+            partition_values=(
+                {self.date_col: self.date}
+                if self.partition and (self.date_col is not None) else None
+            ),
+        )
+        self.keys_index.reset(written_keys)
+        return written_keys
+
+    def write(
+        self,
+        table: pd.DataFrame,
+        appending: bool = False,
+        index_col: Optional[str] = None,
+        orient: str = 'records',
+        compression: Optional[str] = None,
+        **kwargs,
+    ) -> None:
+        """Write a table to the output, replacing or appending to it
+
+        CSV files are written with `index_col` as their first column.
+        """
+        log.debug('    Starting export...')
+        if self.columnar:
+            self._write_columnar(table, appending, compression, **kwargs)
+        elif self.format == 'csv':
+            # export csv, with a header only at the start of the file
+            with open(
+                self.path, 'a' if appending else 'w', encoding='utf-8',
+            ) as outfile:
+                if index_col is not None:
+                    table = table.set_index(index_col)
+                table.to_csv(
+                    outfile, header=(not appending), **kwargs
+                )
+        elif appending:
+            append_json_records(
+                self.path,
+                table.to_json(
+                    orient=orient, indent=4, force_ascii=False, **kwargs
+                ),
+            )
+        else:
+            with open(self.path, 'w', encoding='utf-8') as outfile:
+                outfile.write(table.to_json(
+                    orient=orient, indent=4, force_ascii=False, **kwargs
+                ))
+
+    def _write_columnar(
+        self,
+        table: pd.DataFrame,
+        appending: bool,
+        compression: Optional[str] = None,
+        **kwargs,
+    ) -> None:
+        """Write a table in a binary, columnar file format"""
+        if self.partition:
+            # partition values are kept in folder names only
+            table = table.drop(columns=self.date_col)
+            if appending:
+                # new rows go to a new file in the same partition
+                part_number = len(self.existing_files)
+                while os.path.exists(self.path):
+                    self.path = os.path.join(
+                        self.partition_dir,
+                        f'part-{part_number}.{self.format}',
+                    )
+                    part_number += 1
+            else:
+                for existing_file in self.existing_files:
+                    os.remove(existing_file)
+        # sheet row numbers are meaningless outside the bulletin
+        table = table.reset_index(drop=True)
+        if compression is None:
+            compression = COLUMNAR_FORMATS[self.format]
+        log.debug(f'    Writing {self.format} with {compression}...')
+        if self.format == 'parquet':
+            table.to_parquet(
+                self.path,
+                engine='pyarrow',
+                compression=compression,
+                index=False,
+                **kwargs
+            )
+        else:
+            table.to_feather(self.path, compression=compression, **kwargs)
+
+    def update_index(
+        self,
+        keys: Optional[pd.Series],
+        exist_policy: str,
+        appending: bool = False,
+    ) -> None:
+        """Keep the index of written keys in sync with the output"""
+        if (exist_policy != 'upsert') and not self.keys_index.exists:
+            return
+        if keys is None:
+            # rows without dates can't be indexed anymore
+            os.remove(self.keys_index.path)
+        elif appending:
+            self.keys_index.add(keys)
+        else:
+            self.keys_index.reset(keys)
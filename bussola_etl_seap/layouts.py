@@ -0,0 +1,179 @@
+"""Layouts of bulletin spreadsheets, described in declarative profiles"""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import functools
+import glob
+import json
+import log
+import os
+import pandas as pd
+import re
+import unicodedata
+from typing import Any, Dict, Mapping, Optional, Pattern, Tuple
+
+
+# directory with the profiles of every known layout, as JSON files
+PROFILES_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'layout_profiles',
+)
+
+
+def column_index(letters: str) -> int:
+    """Get the 0-based position of an Excel column from its letters"""
+    position = 0
+    for letter in letters.upper():
+        position = position * 26 + ord(letter) - ord('A') + 1
+    return position - 1
+
+
+def normalize_header(header: str) -> str:
+    """Uppercase a text, without accents, extra spaces or line breaks"""
+    header = unicodedata.normalize('NFKD', header)
+    header = header.encode('ascii', errors='ignore').decode('ascii')
+    return ' '.join(header.upper().split())
+
+
+class BulletinLayout:
+    """Where the data is, and how it is labeled, in a bulletin format
+
+    Layouts are compiled once from their profiles: patterns are compiled,
+    column letters are resolved to positions and section headers are
+    normalized, so that nothing is resolved again for each bulletin.
+    Rows are 0-based, as in the sheet read without headers.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sheet_name: str,
+        colmapping: Mapping[str, str],
+        date_row: int,
+        first_data_row: int,
+        date_pattern: str,
+        date_format: str,
+        regime_map: Mapping[str, str],
+        count_sections: Mapping[str, Mapping[str, str]],
+        first_count_section: str,
+        section_markers: Mapping[str, str],
+        header_cells: Optional[Mapping[Any, Mapping[str, str]]] = None,
+        description: str = '',
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.sheet_name = sheet_name
+        # map excel column letters to desired column names
+        self.colmapping = dict(colmapping)
+        self.usecols = ','.join(self.colmapping)
+        self.col_positions = [
+            column_index(letter) for letter in colmapping
+        ]
+        self.date_row = int(date_row)
+        self.first_data_row = int(first_data_row)
+        self.date_pattern = re.compile(date_pattern)
+        self.date_format = date_format
+        # accepted incarceration types, mapped to their standardized names
+        self.regime_map = dict(regime_map)
+        # facility type and inmates gender of the facilities in each
+        # section of the custody count (values not given are not informed)
+        self.count_sections = {
+            section: dict(values) for section, values in count_sections.items()
+        }
+        # section of the facilities listed before any section header
+        self.first_count_section = first_count_section
+        # section headers in the facility id column, with their spelling
+        # variants; compared ignoring case, accents and repeated spaces
+        self.section_markers = {
+            normalize_header(marker): section
+            for marker, section in section_markers.items()
+        }
+        # patterns of cells that identify the layout, by row and position
+        self.header_cells: Dict[Tuple[int, int], Pattern] = {
+            (int(row), column_index(letter)): re.compile(pattern)
+            for row, cells in (header_cells or {}).items()
+            for letter, pattern in cells.items()
+        }
+        unknown = [
+            section
+            for section in (
+                [first_count_section] + list(self.section_markers.values())
+            )
+            if section not in self.count_sections
+        ]
+        if len(unknown) > 0:
+            log.error(
+                f"Layout '{name}' has markers of undefined sections " +
+                f"{', '.join(sorted(set(unknown)))}."
+            )
+            raise ValueError
+
+    def __repr__(self) -> str:
+        return f'BulletinLayout({self.name!r})'
+
+    @classmethod
+    def from_file(cls, path: str) -> 'BulletinLayout':
+        """Load and compile a layout profile from a JSON file"""
+        log.debug(f'Loading layout profile from {path}...')
+        with open(path, 'r', encoding='utf-8') as profile_file:
+            return cls(**json.load(profile_file))
+
+    def matches(self, workbook: pd.ExcelFile) -> bool:
+        """Check whether a workbook has the sheet and headers of the layout
+
+        Only the rows up to the last identifying cell are read.
+        """
+        if self.sheet_name not in workbook.sheet_names:
+            return False
+        if len(self.header_cells) == 0:
+            return True
+        header = workbook.parse(
+            sheet_name=self.sheet_name,
+            header=None,
+            nrows=max(row for row, _ in self.header_cells) + 1,
+        )
+        for (row, position), pattern in self.header_cells.items():
+            if (row >= header.shape[0]) or (position >= header.shape[1]):
+                return False
+            value = header.iat[row, position]
+            if not (isinstance(value, str) and pattern.search(value.strip())):
+                return False
+        return True
+
+
+@functools.lru_cache(maxsize=None)
+def load_layouts(
+    profiles_dir: str = PROFILES_DIR,
+) -> Dict[str, BulletinLayout]:
+    """Load and compile every layout profile in a directory, only once"""
+    layouts = {}
+    for path in sorted(glob.glob(os.path.join(profiles_dir, '*.json'))):
+        layout = BulletinLayout.from_file(path)
+        layouts[layout.name] = layout
+    return layouts
+
+
+def get_layout(
+    name: str,
+    profiles_dir: str = PROFILES_DIR,
+) -> BulletinLayout:
+    """Get a known layout by its name"""
+    layouts = load_layouts(profiles_dir)
+    if name not in layouts:
+        log.error(
+            f"Unknown bulletin layout '{name}'. Known layouts are " +
+            f"{', '.join(layouts)}."
+        )
+        raise ValueError
+    return layouts[name]
+
+
+def detect_layout(
+    workbook: pd.ExcelFile,
+    profiles_dir: str = PROFILES_DIR,
+) -> BulletinLayout:
+    """Find the first known layout that matches the headers of a workbook"""
+    for layout in load_layouts(profiles_dir).values():
+        if layout.matches(workbook):
+            log.debug(f"Detected bulletin layout '{layout.name}'.")
+            return layout
+    log.error('The bulletin does not match any known layout.')
+    raise ValueError
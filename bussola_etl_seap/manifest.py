@@ -0,0 +1,192 @@
+"""Record of bulletins already loaded to each sink, for incremental runs"""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import datetime
+import json
+import log
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+from . import utils
+
+
+class IngestionManifest:
+    """Local JSON file with the tables each sink received from each bulletin
+
+    Bulletins are identified by the SHA-256 of their files. File sizes and
+    modification times are kept too, so unchanged files are recognized
+    without reading them. Results of another parser version, or parsed
+    with other `options` (such as the date or layout given), don't count
+    as loaded, since tables may have changed.
+
+    Tables partially loaded to a sink keep the number of rows committed,
+    so that their uploads can be resumed. The manifest can be updated from
+    many threads at once.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.bulletins: Dict[str, Dict[str, Any]] = {}
+        # content hashes of input files, by path and stat fingerprint
+        self.fingerprints: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+        if os.path.isfile(path):
+            log.debug(f'Reading ingestion manifest from {path}...')
+            with open(path, 'r', encoding='utf-8') as manifest_file:
+                contents = json.load(manifest_file)
+            self.bulletins = contents['bulletins']
+            self.fingerprints = contents['fingerprints']
+
+    def content_hash(self, input_file: str) -> str:
+        """Get the SHA-256 of a file, reusing it if the file is unchanged"""
+        input_path = os.path.abspath(input_file)
+        stat = os.stat(input_path)
+        fingerprint = self.fingerprints.get(input_path)
+        if (fingerprint is not None) and (
+            (fingerprint['size'] == stat.st_size) and
+            (fingerprint['mtime_ns'] == stat.st_mtime_ns)
+        ):
+            return fingerprint['sha256']
+        content_hash = utils.file_sha256(input_path)
+        self.fingerprints[input_path] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': content_hash,
+        }
+        return content_hash
+
+    def _current(
+        self,
+        content_hash: str,
+        parser_version: str,
+        options: Optional[Mapping[str, Any]],
+    ) -> Optional[Dict]:
+        """Get the record of a bulletin, if it was parsed the same way"""
+        entry = self.bulletins.get(content_hash)
+        if (entry is None) or (
+            (entry['parser_version'] != parser_version) or
+            (entry.get('options', {}) != _given(options))
+        ):
+            return None
+        return entry
+
+    def pending(
+        self,
+        content_hash: str,
+        parser_version: str,
+        sinks: Iterable[str],
+        tablenames: Iterable[str],
+        options: Optional[Mapping[str, Any]] = None,
+    ) -> Dict[str, List[str]]:
+        """Get the tables each sink still needs from a bulletin"""
+        tablenames = list(tablenames)
+        entry = self._current(content_hash, parser_version, options)
+        if entry is None:
+            return {sink: tablenames for sink in sinks}
+        pending = {}
+        for sink in sinks:
+            done = entry['sinks'].get(sink, [])
+            missing = [table for table in tablenames if table not in done]
+            if len(missing) > 0:
+                pending[sink] = missing
+        return pending
+
+    def _entry(
+        self,
+        content_hash: str,
+        parser_version: str,
+        options: Optional[Mapping[str, Any]],
+    ) -> Dict:
+        """Get the record of a bulletin, starting over if parsed otherwise"""
+        entry = self._current(content_hash, parser_version, options)
+        if entry is None:
+            entry = {'parser_version': parser_version, 'sinks': {}}
+            if len(_given(options)) > 0:
+                entry['options'] = _given(options)
+            self.bulletins[content_hash] = entry
+        return entry
+
+    def progress(
+        self,
+        content_hash: str,
+        parser_version: str,
+        sink: str,
+        tablename: str,
+        options: Optional[Mapping[str, Any]] = None,
+    ) -> int:
+        """Get the rows of a table committed to a sink before it failed"""
+        entry = self._current(content_hash, parser_version, options)
+        if entry is None:
+            return 0
+        return entry.get('progress', {}).get(sink, {}).get(tablename, 0)
+
+    def save_progress(
+        self,
+        content_hash: str,
+        parser_version: str,
+        sink: str,
+        tablename: str,
+        rows: int,
+        options: Optional[Mapping[str, Any]] = None,
+    ) -> None:
+        """Record the rows of a table committed to a sink so far, and save"""
+        with self._lock:
+            entry = self._entry(content_hash, parser_version, options)
+            progress = entry.setdefault('progress', {}).setdefault(sink, {})
+            progress[tablename] = rows
+            self.save()
+
+    def mark_done(
+        self,
+        content_hash: str,
+        parser_version: str,
+        sink: str,
+        tablename: str,
+        input_file: Optional[str] = None,
+        date: Optional[datetime.datetime] = None,
+        options: Optional[Mapping[str, Any]] = None,
+    ) -> None:
+        """Record that a sink received a table of a bulletin, and save it"""
+        with self._lock:
+            entry = self._entry(content_hash, parser_version, options)
+            if input_file is not None:
+                entry['input_file'] = os.path.abspath(input_file)
+            if date is not None:
+                entry['date'] = date.isoformat()
+            done = entry['sinks'].setdefault(sink, [])
+            if tablename not in done:
+                done.append(tablename)
+            # tables loaded completely don't need to be resumed
+            entry.get('progress', {}).get(sink, {}).pop(tablename, None)
+            self.save()
+
+    def save(self) -> None:
+        """Write the manifest, replacing the previous file atomically"""
+        manifest_dir = os.path.dirname(os.path.abspath(self.path))
+        with self._lock:
+            file_descriptor, tmp_path = tempfile.mkstemp(
+                prefix='.tmp-', dir=manifest_dir,
+            )
+            with os.fdopen(
+                file_descriptor, 'w', encoding='utf-8',
+            ) as tmp_file:
+                json.dump(
+                    {
+                        'bulletins': self.bulletins,
+                        'fingerprints': self.fingerprints,
+                    },
+                    tmp_file,
+                    indent=2,
+                )
+            os.replace(tmp_path, self.path)
+
+
+def _given(options: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+    """Get the parsing options that were set, as stored in the manifest"""
+    return {
+        name: value
+        for name, value in (options or {}).items()
+        if value is not None
+    }
@@ -0,0 +1,223 @@
+"""Bulk loading of bulletin tables into MongoDB collections"""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import itertools
+import log
+import pandas as pd
+import pymongo
+from pymongo.collection import Collection
+from . import utils
+from .export import Checkpoint
+from typing import (
+    Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional,
+)
+
+
+# server error code for documents violating a unique index (such as '_id')
+DUPLICATE_KEY_ERROR = 11000
+
+# accepted policies for documents that already exist in the destination
+EXIST_POLICIES = ('fail', 'ignore', 'update')
+
+# errors of lost connections to the server, after which loads are retried
+TRANSIENT_ERRORS = (pymongo.errors.AutoReconnect,)
+
+
+class LoadSummary(NamedTuple):
+    """Number of documents inserted, matched and skipped during a load"""
+
+    inserted: int = 0
+    matched: int = 0
+    skipped: int = 0
+
+    def combine(self, other: 'LoadSummary') -> 'LoadSummary':
+        """Add up the documents of two loads"""
+        return LoadSummary(
+            *(mine + theirs for mine, theirs in zip(self, other))
+        )
+
+
+def _chunks(
+    records: Iterable[Dict[str, Any]],
+    chunksize: int,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Split an iterable of records into lists of at most chunksize items"""
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _write_chunk(
+    collection: Collection,
+    chunk: List[Dict[str, Any]],
+    exist_policy: str,
+) -> LoadSummary:
+    """Send a single unordered bulk write request for a chunk of records"""
+    if exist_policy == 'update':
+        requests = [
+            pymongo.ReplaceOne({'_id': record['_id']}, record, upsert=True)
+            for record in chunk
+        ]
+    else:
+        requests = [pymongo.InsertOne(record) for record in chunk]
+    try:
+        result = collection.bulk_write(requests, ordered=False)
+    except pymongo.errors.BulkWriteError as err:
+        # with unordered writes, the server tries every request in the chunk
+        # and reports the ones that failed; duplicates are skipped on purpose
+        write_errors = err.details.get('writeErrors', [])
+        if (
+            (exist_policy != 'ignore')
+            or any(
+                error['code'] != DUPLICATE_KEY_ERROR for error in write_errors
+            )
+        ):
+            raise
+        for error in write_errors:
+            log.debug(f"Record {chunk[error['index']]['_id']} already exists.")
+        return LoadSummary(
+            inserted=err.details.get('nInserted', 0),
+            skipped=len(write_errors),
+        )
+    return LoadSummary(
+        inserted=result.inserted_count + result.upserted_count,
+        matched=result.matched_count,
+    )
+
+
+def bulk_load(
+    collection: Collection,
+    records: Iterable[Dict[str, Any]],
+    exist_policy: str = 'ignore',
+    chunksize: int = 1000,
+    on_chunk: Optional[Callable[[int], None]] = None,
+) -> LoadSummary:
+    """Load records into a collection, with one bulk write per chunk
+
+    `on_chunk` is called with the number of records of each chunk, as soon
+    as it is written.
+    """
+    if exist_policy not in EXIST_POLICIES:
+        log.error(
+            'Policy for existing records must be one of ' +
+            "'fail', 'ignore', or 'update'."
+        )
+        raise ValueError
+    if exist_policy == 'fail':
+        # check every record at once, so nothing is written when aborting
+        records = list(records)
+        existing_ids = [
+            doc['_id'] for doc in collection.find(
+                {'_id': {'$in': [record['_id'] for record in records]}},
+                projection={'_id': True},
+            )
+        ]
+        if len(existing_ids) > 0:
+            log.debug(f'Records already in destination: {existing_ids}')
+            log.error(
+                'One or more records already exist in the destination ' +
+                "and exist_policy is 'fail'. Aborting..."
+            )
+            raise ValueError
+    summary = LoadSummary()
+    for chunk in _chunks(records, chunksize):
+        summary = summary.combine(
+            _write_chunk(collection, chunk, exist_policy),
+        )
+        if on_chunk is not None:
+            on_chunk(len(chunk))
+    log.debug(
+        f'Loaded {collection.name}: {summary.inserted} inserted, ' +
+        f'{summary.matched} matched, {summary.skipped} skipped.'
+    )
+    return summary
+
+
+class MongoLoader:
+    """Pooled connection to a MongoDB database, shared by many loads
+
+    A single loader can be reused across tables, bulletins and threads: the
+    underlying client is thread-safe and keeps a pool of up to `pool_size`
+    connections. Close it (or use it as a context manager) when done.
+    """
+
+    def __init__(
+        self,
+        connection_string: str,
+        database: str = 'seap',
+        pool_size: int = 10,
+        timeout: int = 3000,
+    ) -> None:
+        log.info('Starting connection...')
+        log.debug(connection_string)
+        self.client = pymongo.MongoClient(
+            connection_string,
+            maxPoolSize=pool_size,
+            serverSelectionTimeoutMS=timeout,
+        )
+        self.database = self.client[database]
+
+    def __enter__(self) -> 'MongoLoader':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def load(
+        self,
+        tablename: str,
+        records: Iterable[Dict[str, Any]],
+        exist_policy: str = 'ignore',
+        chunksize: int = 1000,
+        on_chunk: Optional[Callable[[int], None]] = None,
+    ) -> LoadSummary:
+        """Load records into the collection with the given name"""
+        return bulk_load(
+            collection=self.database[tablename],
+            records=records,
+            exist_policy=exist_policy,
+            chunksize=chunksize,
+            on_chunk=on_chunk,
+        )
+
+    def load_table(
+        self,
+        tablename: str,
+        table: pd.DataFrame,
+        exist_policy: str = 'ignore',
+        chunksize: int = 1000,
+        checkpoint: Optional[Checkpoint] = None,
+    ) -> LoadSummary:
+        """Load the rows of a table, updating a checkpoint after each chunk"""
+        try:
+            log.debug('Starting upload...')
+            summary = self.load(
+                tablename=tablename,
+                records=utils.iter_records(table, chunksize),
+                exist_policy=exist_policy,
+                chunksize=chunksize,
+                on_chunk=None if checkpoint is None else checkpoint.commit,
+            )
+        except pymongo.errors.ServerSelectionTimeoutError as err:
+            log.error("MongoDB ERROR: ", err)
+            raise
+        if summary.skipped + summary.matched > 0:
+            log.warn(
+                'Duplicated records were found and handled according ' +
+                'to the policy for existent records. Run this tool ' +
+                'again with --debug option to see the repeated records.'
+            )
+        log.info(
+            f'Finished uploading data to MongoDB: {summary.inserted} ' +
+            f'inserted, {summary.matched} matched, {summary.skipped} ' +
+            'skipped.'
+        )
+        return summary
+
+    def close(self) -> None:
+        """Close every pooled connection"""
+        log.debug('Closing connection to MongoDB...')
+        self.client.close()
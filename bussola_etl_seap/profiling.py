@@ -0,0 +1,156 @@
+"""Lightweight timing and memory instrumentation of ETL stages"""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import contextlib
+import functools
+import inspect
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, ContextManager, Dict, List
+
+
+# shared, do-nothing context used when profiling is disabled
+_NOT_PROFILING = contextlib.nullcontext()
+
+
+class StageProfiler:
+    """Record wall time, CPU time and peak memory of named stages
+
+    Stages can be nested, and stages with the same name are accumulated.
+    Memory allocations are only traced while a stage is running. When
+    disabled, entering a stage costs a single attribute lookup.
+
+    Stages may run in many threads at once. CPU times are counted for the
+    thread running each stage, but memory is traced for the whole process,
+    so peaks of concurrent stages include each other's allocations.
+    """
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._active: List['_Stage'] = []
+        # memory forgotten when peaks had to be reset by clearing traces
+        self._memory_offset = 0
+        # whether memory tracing was started by this profiler
+        self._tracing = False
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # stages in progress make no sense in another process
+        state = dict(self.__dict__, _active=[], _tracing=False)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def stage(self, name: str) -> ContextManager:
+        """Context that records the resources used inside it as a stage"""
+        if not self.enabled:
+            return _NOT_PROFILING
+        return _Stage(self, name)
+
+    def _start_tracing(self) -> None:
+        """Trace memory allocations while the outermost stage runs"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def _stop_tracing(self) -> None:
+        """Stop tracing memory, if tracing was started by this profiler"""
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+            self._memory_offset = 0
+
+    def _traced_memory(self) -> int:
+        """Get the highest memory use since the last reset, in bytes"""
+        _, peak = tracemalloc.get_traced_memory()
+        return self._memory_offset + peak
+
+    def _reset_peak(self) -> int:
+        """Reset the memory peak, returning the current memory use"""
+        current, _ = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:  # Python < 3.9
+            tracemalloc.clear_traces()
+            self._memory_offset += current
+            current = 0
+        return self._memory_offset + current
+
+    def _record(self, name: str, wall: float, cpu: float, peak: int) -> None:
+        """Accumulate the resources used by a stage"""
+        stats = self.stages.setdefault(
+            name,
+            {'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'peak_memory': 0},
+        )
+        stats['calls'] += 1
+        stats['wall_time'] += wall
+        stats['cpu_time'] += cpu
+        stats['peak_memory'] = max(stats['peak_memory'], peak)
+
+
+class _Stage:
+    """Resources used by a single run of a stage"""
+
+    def __init__(self, profiler: StageProfiler, name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.peak = 0
+
+    def _update_peaks(self) -> None:
+        """Propagate the memory peak so far to every active stage"""
+        peak = self.profiler._traced_memory()
+        for stage in self.profiler._active:
+            stage.peak = max(stage.peak, peak)
+
+    def __enter__(self) -> '_Stage':
+        with self.profiler._lock:
+            if not self.profiler._active:
+                self.profiler._start_tracing()
+            # save peaks of running stages before resetting it for this one
+            self._update_peaks()
+            self.start_memory = self.profiler._reset_peak()
+            self.peak = self.start_memory
+            self.profiler._active.append(self)
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.thread_time() - self.start_cpu
+        with self.profiler._lock:
+            self._update_peaks()
+            self.profiler._active.remove(self)
+            self.profiler._record(
+                self.name, wall, cpu, self.peak - self.start_memory,
+            )
+            if not self.profiler._active:
+                self.profiler._stop_tracing()
+
+
+def profiled(stage: str) -> Callable:
+    """Profile calls of a method as a stage of the instance's `_profiler`
+
+    The stage name can use arguments of the method as format fields, e.g.
+    `@profiled('export:file:{tablename}')`.
+    """
+
+    def decorator(method: Callable) -> Callable:
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self._profiler.enabled:
+                return method(self, *args, **kwargs)
+            arguments = signature.bind(self, *args, **kwargs).arguments
+            with self._profiler.stage(stage.format(**arguments)):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
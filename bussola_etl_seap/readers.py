@@ -0,0 +1,96 @@
+"""Engines that read raw bulletin sheets into DataFrames"""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import log
+import numpy as np
+import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+from typing import Any, Callable, Dict, List
+
+from .layouts import BulletinLayout
+
+
+# texts shown by Excel in cells with formula errors
+EXCEL_ERRORS = frozenset(
+    ('#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A')
+)
+
+
+def read_with_pandas(
+    workbook: pd.ExcelFile,
+    layout: BulletinLayout,
+) -> pd.DataFrame:
+    """Read every row of a sheet with the general-purpose pandas reader"""
+    return workbook.parse(
+        sheet_name=layout.sheet_name,
+        header=None,
+        names=layout.colmapping.values(),
+        usecols=layout.usecols,
+    )
+
+
+def _convert_cell(value: Any) -> Any:
+    """Convert a raw cell value the same way pandas does"""
+    if value is None:
+        return np.nan
+    if isinstance(value, str):
+        if (value in STR_NA_VALUES) or (value in EXCEL_ERRORS):
+            return np.nan
+    elif isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def read_with_stream(
+    workbook: pd.ExcelFile,
+    layout: BulletinLayout,
+) -> pd.DataFrame:
+    """Stream a sheet row by row, keeping only the mapped columns
+
+    Rows before the date row of the layout are never parsed, and the
+    resulting index keeps the same row numbers as reading the whole sheet
+    would.
+    """
+    if workbook.engine != 'openpyxl':
+        log.error(
+            "The 'stream' engine can only read .XLSX workbooks. Use the " +
+            "'pandas' engine instead."
+        )
+        raise ValueError
+    col_positions = layout.col_positions
+    first_row = layout.date_row
+    worksheet = workbook.book[layout.sheet_name]
+    # declared dimensions are often wrong (e.g. formatted empty columns)
+    worksheet.reset_dimensions()
+    rows: List[List[Any]] = []
+    last_row_with_data = -1
+    for row in worksheet.iter_rows(
+        min_row=first_row + 1,
+        max_col=max(col_positions) + 1,
+        values_only=True,
+    ):
+        row = [
+            _convert_cell(row[pos]) if pos < len(row) else np.nan
+            for pos in col_positions
+        ]
+        if any(pd.notna(value) for value in row):
+            last_row_with_data = len(rows)
+        rows.append(row)
+    # trim trailing empty rows
+    rows = rows[:last_row_with_data + 1]
+    index = pd.RangeIndex(first_row, first_row + len(rows))
+    columns = zip(*rows) if len(rows) > 0 else [()] * len(col_positions)
+    # build typed columns directly, inferring numbers as the pandas reader
+    return pd.DataFrame({
+        name: pd.to_numeric(
+            pd.Series(values, index=index, dtype=object), errors='ignore',
+        )
+        for name, values in zip(layout.colmapping.values(), columns)
+    })
+
+
+# available engines, by name
+ENGINES: Dict[str, Callable[..., pd.DataFrame]] = {
+    'pandas': read_with_pandas,
+    'stream': read_with_stream,
+}
@@ -0,0 +1,63 @@
+"""Mapping of bulletin tables that are only built when first accessed"""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import log
+import pandas as pd
+from typing import Callable, Dict, Iterator, Mapping, Optional, Sequence
+
+
+class LazyTables(Mapping):
+    """Read-only mapping of table names to DataFrames, built on demand
+
+    Each table has a builder, called with the tables it depends on (in the
+    order they are listed in `dependencies`) the first time it is accessed.
+    Built tables are kept, so that every builder runs at most once.
+    """
+
+    def __init__(
+        self,
+        builders: Mapping[str, Callable[..., pd.DataFrame]],
+        dependencies: Optional[Mapping[str, Sequence[str]]] = None,
+        tables: Optional[Mapping[str, pd.DataFrame]] = None,
+    ) -> None:
+        self.builders = dict(builders)
+        self.dependencies = dict(dependencies or {})
+        self._tables: Dict[str, pd.DataFrame] = dict(tables or {})
+        unknown = [
+            tablename
+            for tablename in self._tables
+            if tablename not in self.builders
+        ]
+        if len(unknown) > 0:
+            log.error(f"No builders for tables {', '.join(unknown)}.")
+            raise ValueError
+
+    def __getitem__(self, tablename: str) -> pd.DataFrame:
+        if tablename not in self._tables:
+            if tablename not in self.builders:
+                raise KeyError(tablename)
+            log.debug(f'Building {tablename} table...')
+            self._tables[tablename] = self.builders[tablename](
+                *(self[dependency] for dependency in self.dependencies.get(
+                    tablename, ()
+                ))
+            )
+        return self._tables[tablename]
+
+    def __contains__(self, tablename: object) -> bool:
+        # checking for a table should not build it
+        return tablename in self.builders
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.builders)
+
+    def __len__(self) -> int:
+        return len(self.builders)
+
+    @property
+    def built(self) -> Sequence[str]:
+        """Names of the tables that were built already"""
+        return [
+            tablename for tablename in self.builders
+            if tablename in self._tables
+        ]
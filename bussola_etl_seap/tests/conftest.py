@@ -1,6 +1,11 @@
 """Unit tests configuration file."""
+# pylint: disable=redefined-outer-name
 
+import anvil.server
+import anvil.tables
 import log
+import pytest
+import types
 
 
 def pytest_configure(config):
@@ -9,3 +14,34 @@ def pytest_configure(config):
 
     terminal = config.pluginmanager.getplugin('terminal')
     terminal.TerminalReporter.showfspath = False
+
+
+class FakeDataTable:
+    """Local stand-in for an Anvil app Data Table, counting remote calls"""
+
+    def __init__(self):
+        self.rows = []
+        self.calls = 0
+
+    def search(self, **kwargs):
+        self.calls += 1
+        return [
+            row for row in self.rows
+            if all(row[col] == value for col, value in kwargs.items())
+        ]
+
+    def add_rows(self, rows):
+        self.calls += 1
+        self.rows.extend(dict(row) for row in rows)
+
+
+@pytest.fixture
+def app_tables(monkeypatch):
+    """Replace the Anvil Uplink connection by local fake Data Tables
+
+    Tables can be added to (or replaced in) the returned namespace.
+    """
+    fake_tables = types.SimpleNamespace(bsp_seap_ocupacao=FakeDataTable())
+    monkeypatch.setattr(anvil.server, 'connect', lambda token: None)
+    monkeypatch.setattr(anvil.tables, 'app_tables', fake_tables)
+    return fake_tables
@@ -0,0 +1,76 @@
+"""Tests for the historical archive of bulletins."""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import os
+import pandas as pd
+import pytest
+
+from ..archive import BulletinArchive
+from ..bussola_etl_seap import SEAPBulletin
+
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+EXAMPLE_FILE_PATH = (
+    os.path.dirname(os.path.dirname(TEST_DIR)) + '/data/input/example.xlsx'
+)
+
+
+@pytest.fixture(scope='module')
+def bulletins():
+    """Bulletins of two consecutive weeks, with one facility changing"""
+    first_week = SEAPBulletin(EXAMPLE_FILE_PATH)
+    second_week = SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-18')
+    occupation = second_week.tables['occupation']
+    occupation.loc[occupation['unidadeId'] == 8, 'efetivoReal'] += 100
+    return first_week, second_week
+
+
+@pytest.fixture
+def archive(tmp_path, bulletins):
+    """Archive with the tables of two bulletins"""
+    with BulletinArchive(str(tmp_path / 'archive.sqlite')) as archive:
+        for bulletin in bulletins:
+            archive.add(bulletin)
+        yield archive
+
+
+def test_add(archive, bulletins):
+    """Tests adding bulletins to the archive, and adding them again"""
+    archive.add(bulletins[0])
+    assert list(archive.dates) == [
+        pd.Timestamp('2020-08-11'), pd.Timestamp('2020-08-18'),
+    ]
+    snapshot = archive.snapshot('2020-08-11', tablename='imprisoned')
+    assert len(snapshot) == len(bulletins[0].tables['imprisoned'])
+
+
+def test_facility_series(archive):
+    """Tests getting the history of a single facility"""
+    series = archive.facility_series(8)
+    assert list(series['efetivoReal']) == [1811, 1911]
+    assert len(archive.facility_series(8, start='2020-08-12')) == 1
+
+
+def test_snapshot(archive, bulletins):
+    """Tests getting a table as it was in a given date"""
+    snapshot = archive.snapshot('2020-08-17')
+    assert (snapshot['registroData'] == pd.Timestamp('2020-08-11')).all()
+    assert len(snapshot) == len(bulletins[0].tables['occupation'])
+
+
+def test_top_overcrowded(archive):
+    """Tests ranking facilities by occupation rate in each bulletin"""
+    top = archive.top_overcrowded(top=3)
+    assert len(top) == 6
+    assert list(top['posicao']) == [1, 2, 3, 1, 2, 3]
+    first_week = top.loc[top['registroData'] == pd.Timestamp('2020-08-11')]
+    assert first_week['taxaOcupacao'].is_monotonic_decreasing
+
+
+def test_week_over_week(archive):
+    """Tests comparing facility values with their previous bulletin"""
+    changes = archive.week_over_week().set_index(
+        ['registroData', 'unidadeId']
+    )['efetivoRealVariacao']
+    assert changes.loc[(pd.Timestamp('2020-08-18'), 8)] == 100
+    assert changes.loc[pd.Timestamp('2020-08-11')].isna().all()
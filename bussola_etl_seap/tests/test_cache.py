@@ -0,0 +1,75 @@
+"""Tests for the cache of parsed bulletins."""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import datetime
+import os
+import pandas as pd
+
+from ..bussola_etl_seap import SEAPBulletin
+from ..cache import BulletinCache
+
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+EXAMPLE_FILE_PATH = (
+    os.path.dirname(os.path.dirname(TEST_DIR)) + '/data/input/example.xlsx'
+)
+
+
+def test_cached_bulletin(tmp_path, monkeypatch):
+    """Tests a cached bulletin is loaded without reading the workbook"""
+    cache = BulletinCache(str(tmp_path))
+    parsed = SEAPBulletin(EXAMPLE_FILE_PATH, cache=cache)
+
+    def fail_reading(*args, **kwargs):
+        raise AssertionError('Bulletin should have been loaded from cache')
+
+    monkeypatch.setattr(SEAPBulletin, '_read_bulletin', fail_reading)
+    monkeypatch.setattr(pd, 'ExcelFile', fail_reading)
+    cached = SEAPBulletin(EXAMPLE_FILE_PATH, cache=cache)
+    assert cached.date == parsed.date == datetime.datetime(2020, 8, 11)
+    for tablename, table in parsed.tables.items():
+        pd.testing.assert_frame_equal(cached.tables[tablename], table)
+    # user-provided dates still take precedence over cached ones
+    cached = SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-12', cache=cache)
+    assert cached.date == datetime.datetime(2020, 8, 12)
+
+
+def test_cached_header_date(tmp_path, monkeypatch):
+    """Tests a bulletin cached with a given date is reused without one"""
+    cache = BulletinCache(str(tmp_path))
+    SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-12', cache=cache)
+
+    def fail_reading(*args, **kwargs):
+        raise AssertionError('Bulletin should have been loaded from cache')
+
+    monkeypatch.setattr(SEAPBulletin, '_read_bulletin', fail_reading)
+    cached = SEAPBulletin(EXAMPLE_FILE_PATH, cache=cache)
+    assert cached.date == datetime.datetime(2020, 8, 11)
+
+
+def test_cache_parser_version(tmp_path, monkeypatch):
+    """Tests results from other parser versions are not reused"""
+    cache = BulletinCache(str(tmp_path))
+    SEAPBulletin(EXAMPLE_FILE_PATH, cache=cache)
+    monkeypatch.setattr(SEAPBulletin, 'parser_version', 'test')
+    assert len(os.listdir(tmp_path)) == 1
+    SEAPBulletin(EXAMPLE_FILE_PATH, cache=cache)
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_cache_eviction(tmp_path):
+    """Tests least recently used entries are removed when cache is full"""
+    cache = BulletinCache(str(tmp_path))
+    tables = {'facilities': pd.DataFrame({'unidadeId': range(1000)})}
+    for last_used, key in enumerate(('a', 'b', 'c')):
+        cache.put(key, None, tables)
+        os.utime(tmp_path / key / cache.meta_file, (last_used, last_used))
+    entry_size = sum(
+        entry.stat().st_size for entry in os.scandir(tmp_path / 'a')
+    )
+    # reading an entry makes it the most recently used one
+    assert cache.get('a') is not None
+    cache.max_size = 2 * entry_size
+    cache.put('d', None, tables)
+    assert sorted(os.listdir(tmp_path)) == ['a', 'd']
+    assert cache.get('b') is None
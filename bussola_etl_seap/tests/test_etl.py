@@ -1,13 +1,20 @@
 """Tests for SEAP ETL modules."""
 # pylint: disable=redefined-outer-name,singleton-comparison
 
+import concurrent.futures
 import datetime
+import functools
+import io
 import os
+import pytest
 import time
-from getpass import getpass
 import log
+import openpyxl
+import pandas as pd
 
-from ..bussola_etl_seap import SEAPBulletin
+from ..bussola_etl_seap import SEAPBulletin, _parse_ahead
+from ..export import Checkpoint
+from .conftest import FakeDataTable
 
 
 log.reset()
@@ -20,9 +27,6 @@ INPUT_DIR = DATA_DIR + '/input'
 OUTPUT_DIR = DATA_DIR + '/output'
 EXAMPLE_FILE_PATH = INPUT_DIR + '/example.xlsx'
 
-ANVIL_TOKEN = os.environ.get('ANVIL_TOKEN')
-if ANVIL_TOKEN is None:
-    ANVIL_TOKEN = getpass('Please provide an anvil API token: ')
 
 def test_extract_localfile():
     """Tests whether extraction from local XLSX file is working as expected"""
@@ -36,6 +40,131 @@ def test_date_parsing():
     bulletin = SEAPBulletin(EXAMPLE_FILE_PATH)
     assert bulletin.date.date() == datetime.date(2020, 8, 11)
 
+def test_stream_engine():
+    """Tests the streaming reader gets the same results as pandas' one"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH)
+    streamed = SEAPBulletin(EXAMPLE_FILE_PATH, engine='stream')
+    assert streamed.date == bulletin.date
+    for tablename, table in bulletin.tables.items():
+        pd.testing.assert_frame_equal(streamed.tables[tablename], table)
+    # whatever engine pandas would pick for the file
+    assert streamed.workbook.engine == 'openpyxl'
+    streamed.close()
+    with pytest.raises(ValueError):
+        SEAPBulletin(EXAMPLE_FILE_PATH, engine='unknown')
+
+def test_in_memory_input():
+    """Tests parsing bulletins from bytes and file-like objects"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH)
+    with open(EXAMPLE_FILE_PATH, 'rb') as infile:
+        content = infile.read()
+    for input_file in (content, io.BytesIO(content)):
+        in_memory = SEAPBulletin(input_file)
+        assert in_memory.date == bulletin.date
+        for tablename, table in bulletin.tables.items():
+            pd.testing.assert_frame_equal(in_memory.tables[tablename], table)
+
+
+def test_compact_tables():
+    """Tests parsing tables with categories and small integer dtypes"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH)
+    compact = SEAPBulletin(EXAMPLE_FILE_PATH, compact=True)
+    for tablename, table in bulletin.tables.items():
+        compact_table = compact.tables[tablename]
+        assert compact_table[compact.id_col].dtype == 'Int32'
+        for col in compact_table.columns:
+            if col in compact.compact_text_cols:
+                assert compact_table[col].dtype == 'category'
+            elif col in compact.compact_count_cols:
+                assert compact_table[col].dtype == 'UInt16'
+        # values are the same
+        pd.testing.assert_frame_equal(
+            compact_table.astype(table.dtypes), table,
+        )
+    assert compact.dated('occupation')['registroData'].dtype == (
+        'datetime64[ns]'
+    )
+
+
+def test_compact_tables_concat(tmp_path):
+    """Tests compact tables of bulletins with other values stay categorical
+    when concatenated"""
+    workbook = openpyxl.load_workbook(EXAMPLE_FILE_PATH)
+    sheet = workbook['Efetivo Completo']
+    for (cell,) in sheet.iter_rows(min_row=9, min_col=4, max_col=4):
+        if cell.value is not None:
+            cell.value = 'Fechado'
+    closed_only_path = str(tmp_path / 'closed_only.xlsx')
+    workbook.save(closed_only_path)
+    bulletins = [
+        SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-11', compact=True),
+        SEAPBulletin(closed_only_path, date='2020-08-18', compact=True),
+    ]
+    regimes = [
+        set(bulletin.tables['imprisoned']['efetivoRegime'])
+        for bulletin in bulletins
+    ]
+    assert regimes[0] != regimes[1]
+    for tablename in ('facilities', 'imprisoned'):
+        concatenated = pd.concat(
+            [bulletin.tables[tablename] for bulletin in bulletins],
+        )
+        for col in ('unidadeTipo', 'efetivoRegime', 'efetivoGenero'):
+            if col in concatenated.columns:
+                assert concatenated[col].dtype == 'category'
+
+
+def test_workbook_opened_once(monkeypatch):
+    """Tests the workbook is opened a single time per bulletin"""
+    opened = []
+    excel_file = pd.ExcelFile
+
+    def counting_excel_file(*args, **kwargs):
+        opened.append(args)
+        return excel_file(*args, **kwargs)
+
+    monkeypatch.setattr(pd, 'ExcelFile', counting_excel_file)
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH)
+    assert len(opened) == 1
+    # handle is released after parsing, and reopened only on demand
+    assert bulletin.workbook.sheet_names[0] == 'Efetivo Completo'
+    assert len(opened) == 2
+
+def test_lazy_tables():
+    """Tests tables are only built when needed"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH)
+    assert bulletin.tables.built == []
+    assert list(bulletin.tables) == [
+        'facilities', 'capacity', 'imprisoned', 'imprisoned_detail',
+        'occupation',
+    ]
+    bulletin.tables['capacity']
+    assert bulletin.tables.built == ['capacity']
+    # only occupation dependencies are built along with it
+    bulletin.tables['occupation']
+    assert bulletin.tables.built == [
+        'facilities', 'capacity', 'imprisoned_detail', 'occupation',
+    ]
+
+def test_profile(tmp_path):
+    """Tests recording resources used by each processing stage"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH, profile=True)
+    bulletin.to_file(
+        output_file=str(tmp_path / '[YYYY][MM][DD]_SEAPRJ.csv'),
+        tablename='facilities'
+    )
+    bulletin.tables['occupation']
+    for stage in (
+        'read', 'subtotals', 'fill', 'names', 'regimes', 'occupation',
+        'export:file:facilities',
+    ):
+        assert bulletin.profile[stage]['calls'] == 1
+        assert bulletin.profile[stage]['wall_time'] > 0
+        assert bulletin.profile[stage]['peak_memory'] >= 0
+    # disabled by default
+    assert SEAPBulletin(EXAMPLE_FILE_PATH).profile == {}
+
+
 def test_to_csv():
     """Tests exporting bulletin to local CSV file"""
     start = time.time()
@@ -75,11 +204,286 @@ def test_to_json():
         log.info(f"Checking whether {_file} was updated...")
         assert os.path.getmtime(_file) >= start
 
-def test_to_anvil():
+def test_to_columnar(tmp_path):
+    """Tests exporting bulletin to Parquet and Feather files"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH)
+    for output_format in ('parquet', 'feather'):
+        output_file = tmp_path / f'[YYYY][MM][DD]_SEAPRJ.{output_format}'
+        bulletin.to_file(
+            output_file=str(output_file),
+            tablename='imprisoned',
+            date_col='registroData',
+        )
+        exported = getattr(pd, f'read_{output_format}')(
+            tmp_path / f'20200811_SEAPRJ_imprisoned.{output_format}'
+        )
+        assert len(exported) == len(bulletin.tables['imprisoned'])
+        assert exported['efetivoRegime'].dtype == 'category'
+        assert exported['registroData'][0] == datetime.date(2020, 8, 11)
+
+def test_to_partitioned_parquet(tmp_path):
+    """Tests exporting bulletin to Parquet files partitioned by date"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH)
+    bulletin.to_file(
+        output_file=str(tmp_path / 'SEAPRJ.parquet'),
+        tablename='occupation',
+        date_col='registroData',
+        partition=True,
+    )
+    partition_file = (
+        tmp_path / 'SEAPRJ' / 'occupation' / 'registroData=2020-08-11' /
+        'part.parquet'
+    )
+    assert os.path.isfile(partition_file)
+    # date is only kept in the partition folder name
+    assert 'registroData' not in pd.read_parquet(partition_file).columns
+    exported = pd.read_parquet(tmp_path / 'SEAPRJ' / 'occupation')
+    assert (exported['registroData'] == '2020-08-11').all()
+    with pytest.raises(ValueError):
+        bulletin.to_file(
+            output_file=str(tmp_path / 'SEAPRJ.csv'),
+            tablename='occupation',
+            date_col='registroData',
+            partition=True,
+        )
+    with pytest.raises(RuntimeError):
+        bulletin.to_file(
+            output_file=str(tmp_path / 'SEAPRJ.xml'), tablename='occupation',
+        )
+    assert not os.path.exists(tmp_path / 'SEAPRJ_occupation.xml')
+
+def test_to_file_policies(tmp_path):
+    """Tests failing, appending and upserting to existing local files"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH)
+    num_records = len(bulletin.tables['imprisoned'])
+    for output_format in ('csv', 'json'):
+        output_file = str(tmp_path / f'SEAPRJ.{output_format}')
+        outfile_path = tmp_path / f'SEAPRJ_imprisoned.{output_format}'
+        read = getattr(pd, f'read_{output_format}')
+        export = functools.partial(
+            bulletin.to_file,
+            output_file=output_file,
+            tablename='imprisoned',
+            date_col='registroData',
+        )
+        export(exist_policy='fail')
+        with pytest.raises(ValueError):
+            export(exist_policy='fail')
+        export(exist_policy='append')
+        # header is written only once, and the JSON array is kept valid
+        assert len(read(outfile_path)) == 2 * num_records
+        # index of written keys is created from the file contents
+        export(exist_policy='upsert')
+        assert len(read(outfile_path)) == 2 * num_records
+        assert os.path.isfile(str(outfile_path) + '.keys')
+        export(exist_policy='overwrite')
+        assert len(read(outfile_path)) == num_records
+        export(exist_policy='upsert')
+        assert len(read(outfile_path)) == num_records
+        # indexes of outputs removed since are not trusted
+        os.remove(outfile_path)
+        export(exist_policy='upsert')
+        assert len(read(outfile_path)) == num_records
+    # only rows with new keys are upserted
+    next_week = SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-18')
+    next_week.to_file(
+        output_file=str(tmp_path / 'SEAPRJ.csv'),
+        tablename='imprisoned',
+        date_col='registroData',
+        exist_policy='upsert',
+    )
+    assert len(pd.read_csv(tmp_path / 'SEAPRJ_imprisoned.csv')) == (
+        2 * num_records
+    )
+
+def test_to_partitioned_parquet_policies(tmp_path):
+    """Tests appending and upserting to partitioned Parquet files"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH)
+    export = functools.partial(
+        bulletin.to_file,
+        output_file=str(tmp_path / 'SEAPRJ.parquet'),
+        tablename='facilities',
+        date_col='registroData',
+        partition=True,
+    )
+    partition_dir = tmp_path / 'SEAPRJ' / 'facilities'
+    export(exist_policy='fail')
+    export(exist_policy='append')
+    export(exist_policy='upsert')
+    assert sorted(os.listdir(partition_dir / 'registroData=2020-08-11')) == [
+        '_keys', 'part-1.parquet', 'part.parquet',
+    ]
+    assert len(pd.read_parquet(partition_dir)) == (
+        2 * len(bulletin.tables['facilities'])
+    )
+    # files that are not partitioned can't be appended to
+    export = functools.partial(
+        bulletin.to_file,
+        output_file=str(tmp_path / 'SEAPRJ.parquet'),
+        tablename='facilities',
+    )
+    export(exist_policy='fail')
+    with pytest.raises(ValueError):
+        export(exist_policy='append')
+
+def test_iter_records():
+    """Test getting table rows as records with native Python values"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-11')
+    records = list(bulletin.iter_records(
+        'capacity', chunksize=7, date_col='registroData',
+    ))
+    assert len(records) == len(bulletin.tables['capacity'])
+    assert type(records[0][bulletin.id_col]) is int
+    assert records[0]['registroData'] == datetime.date(2020, 8, 11)
+
+
+def test_to_anvil(app_tables):
     """Test exporting to an Anvil app"""
     bulletin = SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-11')
+    outtable = app_tables.bsp_seap_ocupacao
     assert bulletin.to_anvil(
         tablename='occupation',
         output_table='bsp_seap_ocupacao',
-        token=ANVIL_TOKEN,
+        token='fake-token',
+        chunksize=20,
+    )
+    num_records = len(bulletin.tables['occupation'])
+    assert len(outtable.rows) == num_records
+    # one search, plus one call per batch of rows
+    assert outtable.calls == 1 + -(-num_records // 20)
+
+
+def test_to_anvil_policies(app_tables):
+    """Test handling records that already exist in the Anvil app"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-11')
+    outtable = app_tables.bsp_seap_ocupacao
+    upload_options = dict(
+        tablename='occupation',
+        output_table='bsp_seap_ocupacao',
+        token='fake-token',
+    )
+    bulletin.to_anvil(**upload_options)
+    num_records = len(outtable.rows)
+    bulletin.to_anvil(exist_policy='ignore', **upload_options)
+    assert len(outtable.rows) == num_records
+    with pytest.raises(ValueError):
+        bulletin.to_anvil(exist_policy='fail', **upload_options)
+    assert len(outtable.rows) == num_records
+    bulletin.to_anvil(exist_policy='force', **upload_options)
+    assert len(outtable.rows) == 2 * num_records
+
+
+def test_to_anvil_checkpoint(app_tables):
+    """Test resuming an upload to Anvil from the last batch committed"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-11')
+    outtable = app_tables.bsp_seap_ocupacao
+    num_records = len(bulletin.tables['occupation'])
+    checkpoint = Checkpoint(rows=20)
+    bulletin.to_anvil(
+        tablename='occupation',
+        output_table='bsp_seap_ocupacao',
+        token='fake-token',
+        chunksize=20,
+        exist_policy='fail',
+        checkpoint=checkpoint,
     )
+    assert len(outtable.rows) == num_records - 20
+    assert checkpoint.rows == num_records
+
+
+def test_to_anvil_compact(app_tables):
+    """Test compact tables are uploaded with the same hashes as the others"""
+    hashes = []
+    for compact in (False, True):
+        bulletin = SEAPBulletin(
+            EXAMPLE_FILE_PATH, date='2020-08-11', compact=compact,
+        )
+        uploaded = {}
+        for tablename in bulletin.tablenames:
+            uploaded[tablename] = FakeDataTable()
+            setattr(app_tables, tablename, uploaded[tablename])
+            bulletin.to_anvil(tablename=tablename, token='fake-token')
+        hashes.append({
+            tablename: [row['registroSHA256'] for row in outtable.rows]
+            for tablename, outtable in uploaded.items()
+        })
+    assert hashes[0] == hashes[1]
+
+
+def test_info_from_name():
+    """Tests extracting gender and abbreviations from facility names"""
+    names = pd.DataFrame({
+        'unidadeNome': [
+            'Casa do Albergado Crispim Ventino - SEAPAC -MASCULINO',
+            'Sanatório Penal - SEAPSP - FEM',
+            'Presídio Hélio Gomes-SEAPHG',
+            'Unidade sem sigla',
+        ],
+        'unidadeSigla': '',
+        'efetivoGenero': 'Não Informado',
+    })
+    parsed = SEAPBulletin._info_from_name(
+        names,
+        name_patterns=SEAPBulletin.gender_patterns,
+        category_col='efetivoGenero',
+    )
+    parsed = SEAPBulletin._info_from_name(
+        parsed,
+        name_patterns=SEAPBulletin.abbreviation_patterns,
+    )
+    assert parsed['efetivoGenero'].tolist() == [
+        'Masculino', 'Feminino', 'Não Informado', 'Não Informado',
+    ]
+    assert parsed['unidadeSigla'].str.strip().tolist() == [
+        'SEAPAC', 'SEAPSP', 'SEAPHG', '',
+    ]
+    assert parsed.at[3, 'unidadeNome'] == 'Unidade sem sigla'
+
+
+def test_unmapped_regimes():
+    """Tests regime types not mapped are counted and set as not informed"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-11')
+    unmapped = bulletin.unmapped_regimes
+    assert unmapped is not None
+    assert unmapped['Prov/Fech'] == 2
+    regimes = bulletin.tables['imprisoned']['efetivoRegime']
+    assert set(regimes) <= (
+        set(bulletin.layout.regime_map.values()) | {SEAPBulletin.no_info}
+    )
+    assert (regimes == SEAPBulletin.no_info).sum() >= sum(
+        unmapped.values()
+    )
+
+
+def test_info_from_subtotals():
+    """Tests sections are found with spelling variants or missing headers"""
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-11')
+    count = pd.DataFrame({'unidadeId': [
+        1, 'SUBTOTAL', 'Casa do  Albergado', 2, 'UNIDADES HOSPITALARES', 3,
+    ]})
+    parsed = bulletin._info_from_subtotals(count)
+    assert parsed['unidadeTipo'].tolist() == [SEAPBulletin.no_info] * 2 + [
+        'Casa do Albergado'
+    ] * 2 + ['Hospital de Custódia e Tratamento Psiquiatrico'] * 2
+    assert parsed['efetivoGenero'].tolist() == ['Masculino'] * 2 + [
+        SEAPBulletin.no_info
+    ] * 4
+
+
+def test_parse_ahead():
+    """Tests only a few bulletins are parsed ahead of the one in use"""
+    parsed = []
+
+    def parse(input_file):
+        parsed.append(input_file)
+        return input_file
+
+    input_files = [f'{number}.xlsx' for number in range(10)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        results = _parse_ahead(executor, parse, input_files, window=4)
+        for number, result in enumerate(results):
+            assert result == input_files[number]
+            # give idle workers time to take any file submitted
+            time.sleep(0.05)
+            assert len(parsed) <= number + 1 + 4
+    assert parsed == input_files
@@ -0,0 +1,125 @@
+"""Tests for the concurrent export of tables to many sinks."""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import pytest
+import threading
+import time
+import types
+from typing import List, cast
+
+from ..bussola_etl_seap import SEAPBulletin
+from ..export import (
+    TRANSIENT_ERRORS, Checkpoint, ExportScheduler, get_backend,
+    transient_errors,
+)
+
+
+class FakeBulletin:
+    """Bulletin stand-in, with tables that are already built"""
+
+    input_file = 'example.xlsx'
+    tables = {'facilities': None, 'capacity': None, 'occupation': None}
+
+
+def fake_bulletin() -> SEAPBulletin:
+    """Get a bulletin stand-in, typed as the bulletins it stands in for"""
+    return cast(SEAPBulletin, FakeBulletin())
+
+
+def test_export_isolates_failures():
+    """Tests a failing sink doesn't stop the others"""
+    received = []
+
+    def failing_sink(bulletin, tablename, checkpoint):
+        raise ConnectionError('lost connection')
+
+    sinks = {
+        'file:out.csv': lambda bulletin, table, _: received.append(table),
+        'mongo:seap': failing_sink,
+    }
+    done = []
+    with ExportScheduler(sinks) as scheduler:
+        scheduler.export(
+            fake_bulletin(),
+            {sink: list(FakeBulletin.tables) for sink in sinks},
+            on_done=lambda sink, table: done.append((sink, table)),
+        )
+    # tables keep their order in sinks with a single worker
+    assert received == list(FakeBulletin.tables)
+    assert sorted(done) == [
+        ('file:out.csv', table) for table in sorted(received)
+    ]
+    assert scheduler.summary['file:out.csv'].exported == 3
+    assert scheduler.summary['mongo:seap'].failed == 3
+    assert scheduler.failed == 3
+    _, tablename, error = scheduler.summary['mongo:seap'].errors[0]
+    assert tablename in FakeBulletin.tables
+    assert isinstance(error, ConnectionError)
+
+
+def test_export_concurrency():
+    """Tests sinks run at the same time, within their own limits"""
+    lock = threading.Lock()
+    running = types.SimpleNamespace(now=0, most=0)
+
+    def slow_sink(bulletin, tablename, checkpoint):
+        with lock:
+            running.now += 1
+            running.most = max(running.most, running.now)
+        time.sleep(0.05)
+        with lock:
+            running.now -= 1
+
+    sinks = {'anvil:': slow_sink, 'mongo:seap': slow_sink}
+    tablenames = list(FakeBulletin.tables)
+    start = time.perf_counter()
+    with ExportScheduler(sinks, concurrency={'mongo:seap': 3}) as scheduler:
+        scheduler.export(
+            fake_bulletin(), {sink: tablenames for sink in sinks},
+        )
+    elapsed = time.perf_counter() - start
+    # three tables to Anvil, one at a time, alongside the MongoDB ones
+    assert running.most == 4
+    assert elapsed < 0.05 * 5
+    assert scheduler.summary['anvil:'].exported == 3
+
+
+def test_export_retries_from_checkpoint():
+    """Tests exports are retried from the last chunk committed"""
+    written = []
+    failures = [ConnectionError('lost connection')] * 2
+
+    def flaky_sink(bulletin, tablename, checkpoint):
+        for row in range(checkpoint.rows, 10, 4):
+            if row == 4 and failures:
+                raise failures.pop()
+            written.append(row)
+            checkpoint.commit(min(4, 10 - row))
+
+    saved: List[int] = []
+    sinks = {'mongo:seap': flaky_sink}
+    with ExportScheduler(sinks, retries=2, backoff=0) as scheduler:
+        scheduler.export(
+            fake_bulletin(),
+            {'mongo:seap': ['facilities']},
+            get_checkpoint=lambda sink, table: Checkpoint(
+                on_commit=saved.append,
+            ),
+        )
+    # the first chunk is written once, even though the export failed twice
+    assert written == [0, 4, 8]
+    assert saved == [4, 8, 10]
+    assert scheduler.summary['mongo:seap'].retries == 2
+    with ExportScheduler(sinks, retries=0) as scheduler:
+        failures.append(ConnectionError('lost connection'))
+        scheduler.export(fake_bulletin(), {'mongo:seap': ['facilities']})
+    assert scheduler.failed == 1
+
+
+def test_backend_transient_errors():
+    """Tests transient errors of backends count once they are imported"""
+    mongo = get_backend('mongo')
+    assert set(TRANSIENT_ERRORS) < set(transient_errors())
+    assert set(mongo.TRANSIENT_ERRORS) < set(transient_errors())
+    with pytest.raises(ValueError):
+        get_backend('ftp')
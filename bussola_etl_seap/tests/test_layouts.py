@@ -0,0 +1,48 @@
+"""Tests for the layouts of bulletin spreadsheets."""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import json
+import os
+import pandas as pd
+import pytest
+
+from ..layouts import (
+    PROFILES_DIR, BulletinLayout, detect_layout, get_layout, load_layouts,
+)
+
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+EXAMPLE_FILE_PATH = (
+    os.path.dirname(os.path.dirname(TEST_DIR)) + '/data/input/example.xlsx'
+)
+
+
+def test_load_layouts():
+    """Tests profiles are compiled once, with resolved columns"""
+    assert load_layouts() is load_layouts()
+    layout = get_layout('seap-2020')
+    assert layout.col_positions[:4] == [0, 1, 2, 3]
+    assert layout.section_markers['CASA DO ALBERGARDO'] == 'shelter'
+    with pytest.raises(ValueError):
+        get_layout('unknown')
+
+
+def test_detect_layout(tmp_path):
+    """Tests the layout matching the workbook headers is chosen"""
+    with open(
+        os.path.join(PROFILES_DIR, 'seap-2020.json'), encoding='utf-8',
+    ) as profile_file:
+        profile = json.load(profile_file)
+    # an older layout, sorted first, with other headers
+    older = dict(
+        profile, name='seap-2019', header_cells={'5': {'D': '^Tipo$'}},
+    )
+    for name, contents in (('a-2019', older), ('b-2020', profile)):
+        with open(tmp_path / f'{name}.json', 'w', encoding='utf-8') as outfile:
+            json.dump(contents, outfile)
+    with pd.ExcelFile(EXAMPLE_FILE_PATH) as workbook:
+        layout = detect_layout(workbook, profiles_dir=str(tmp_path))
+        assert layout.name == 'seap-2020'
+        assert not BulletinLayout(**older).matches(workbook)
+    with pytest.raises(ValueError):
+        BulletinLayout(**dict(profile, first_count_section='unknown'))
@@ -0,0 +1,96 @@
+"""Tests for the manifest of bulletins already loaded."""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import datetime
+import os
+import shutil
+from typing import List
+
+from .. import utils
+from ..manifest import IngestionManifest
+
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+EXAMPLE_FILE_PATH = (
+    os.path.dirname(os.path.dirname(TEST_DIR)) + '/data/input/example.xlsx'
+)
+
+
+def test_pending_sinks(tmp_path):
+    """Tests only tables not loaded to each sink are pending"""
+    manifest_path = str(tmp_path / 'manifest.json')
+    manifest = IngestionManifest(manifest_path)
+    content_hash = manifest.content_hash(EXAMPLE_FILE_PATH)
+    tables = ['facilities', 'occupation']
+    sinks = ['file:out.csv', 'mongo:seap']
+    assert manifest.pending(content_hash, '1', sinks, tables) == {
+        'file:out.csv': tables, 'mongo:seap': tables,
+    }
+    for tablename in tables:
+        manifest.mark_done(
+            content_hash, '1', 'file:out.csv', tablename,
+            date=datetime.datetime(2020, 8, 11),
+        )
+    manifest.mark_done(content_hash, '1', 'mongo:seap', 'facilities')
+    # progress is saved and read back
+    manifest = IngestionManifest(manifest_path)
+    assert manifest.pending(content_hash, '1', sinks, tables) == {
+        'mongo:seap': ['occupation'],
+    }
+    assert manifest.pending(content_hash, '1', sinks[:1], tables) == {}
+    # tables parsed by other versions must be loaded again
+    assert manifest.pending(content_hash, '2', sinks[:1], tables) == {
+        'file:out.csv': tables,
+    }
+
+
+def test_pending_options(tmp_path):
+    """Tests bulletins parsed with other options are loaded again"""
+    manifest_path = str(tmp_path / 'manifest.json')
+    manifest = IngestionManifest(manifest_path)
+    sinks = ['file:out.csv']
+    tables = ['facilities']
+    options = {'date': '2020-08-18T00:00:00', 'layout': None}
+    manifest.mark_done('abc123', '1', sinks[0], tables[0], options=options)
+    manifest = IngestionManifest(manifest_path)
+    assert manifest.pending('abc123', '1', sinks, tables, options) == {}
+    # options that were not set don't tell runs apart
+    assert manifest.pending(
+        'abc123', '1', sinks, tables, {'date': '2020-08-18T00:00:00'},
+    ) == {}
+    assert manifest.pending('abc123', '1', sinks, tables) == {
+        'file:out.csv': tables,
+    }
+    assert manifest.pending(
+        'abc123', '1', sinks, tables, {'date': '2020-08-11T00:00:00'},
+    ) == {'file:out.csv': tables}
+
+
+def test_progress(tmp_path):
+    """Tests rows committed to a sink are kept until the table is done"""
+    manifest_path = str(tmp_path / 'manifest.json')
+    manifest = IngestionManifest(manifest_path)
+    args = ('abc123', '1', 'mongo:seap', 'occupation')
+    assert manifest.progress(*args) == 0
+    manifest.save_progress(*args, rows=500)
+    manifest = IngestionManifest(manifest_path)
+    assert manifest.progress(*args) == 500
+    assert manifest.progress('abc123', '2', 'mongo:seap', 'occupation') == 0
+    manifest.mark_done(*args)
+    assert manifest.progress(*args) == 0
+
+
+def test_content_hash(tmp_path, monkeypatch):
+    """Tests files are only hashed again if they change"""
+    input_file = str(tmp_path / 'bulletin.xlsx')
+    shutil.copy(EXAMPLE_FILE_PATH, input_file)
+    manifest = IngestionManifest(str(tmp_path / 'manifest.json'))
+    content_hash = manifest.content_hash(input_file)
+    assert content_hash == utils.file_sha256(EXAMPLE_FILE_PATH)
+    hashed: List[str] = []
+    monkeypatch.setattr(utils, 'file_sha256', hashed.append)
+    assert manifest.content_hash(input_file) == content_hash
+    assert hashed == []
+    os.utime(input_file, ns=(0, 0))
+    manifest.content_hash(input_file)
+    assert hashed == [os.path.abspath(input_file)]
@@ -0,0 +1,98 @@
+"""Tests for bulk loading bulletin tables into MongoDB."""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import os
+import pymongo
+import pytest
+from typing import List
+
+from ..bussola_etl_seap import SEAPBulletin
+from ..mongo import LoadSummary, MongoLoader, bulk_load
+
+
+mongomock = pytest.importorskip('mongomock')
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+EXAMPLE_FILE_PATH = (
+    os.path.dirname(os.path.dirname(TEST_DIR)) + '/data/input/example.xlsx'
+)
+
+
+@pytest.fixture
+def collection():
+    """Empty collection in an in-memory MongoDB mock"""
+    return mongomock.MongoClient()['seap']['occupation']
+
+
+@pytest.fixture
+def records():
+    """Minimal documents with precomputed ids"""
+    return [{'_id': str(i), 'efetivoReal': i} for i in range(5)]
+
+
+def test_bulk_load_ignore(collection, records):
+    """Tests loading records twice skips the ones already there"""
+    committed: List[int] = []
+    assert bulk_load(
+        collection, records, chunksize=2, on_chunk=committed.append,
+    ) == LoadSummary(inserted=5)
+    assert committed == [2, 2, 1]
+    assert bulk_load(collection, records, chunksize=2) == LoadSummary(
+        skipped=5,
+    )
+    assert collection.count_documents({}) == 5
+
+
+def test_bulk_load_update(collection, records):
+    """Tests the update policy replaces existing records"""
+    bulk_load(collection, records[:3])
+    records[0]['efetivoReal'] = 100
+    summary = bulk_load(collection, records, exist_policy='update')
+    assert summary == LoadSummary(inserted=2, matched=3)
+    assert collection.find_one({'_id': '0'})['efetivoReal'] == 100
+
+
+def test_bulk_load_fail(collection, records):
+    """Tests the fail policy aborts before writing anything"""
+    bulk_load(collection, records[:1])
+    with pytest.raises(ValueError):
+        bulk_load(collection, records, exist_policy='fail')
+    assert collection.count_documents({}) == 1
+
+
+def test_to_mongo(monkeypatch):
+    """Tests exporting bulletin tables to a MongoDB instance"""
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(pymongo, 'MongoClient', lambda *args, **kwargs: client)
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-11')
+    summary = bulletin.to_mongo(
+        tablename='occupation',
+        connection_string='mongodb://localhost:27017',
+        database='seap',
+    )
+    assert summary.inserted == len(bulletin.tables['occupation'])
+    summary = bulletin.to_mongo(
+        tablename='occupation',
+        connection_string='mongodb://localhost:27017',
+        database='seap',
+    )
+    assert summary.skipped == len(bulletin.tables['occupation'])
+
+
+def test_to_mongo_shared_loader(monkeypatch):
+    """Tests every table reuses the connection of a single loader"""
+    clients = []
+
+    def mock_client(*args, **kwargs):
+        clients.append(mongomock.MongoClient())
+        return clients[-1]
+
+    monkeypatch.setattr(pymongo, 'MongoClient', mock_client)
+    bulletin = SEAPBulletin(EXAMPLE_FILE_PATH, date='2020-08-11')
+    with MongoLoader('mongodb://localhost:27017', pool_size=2) as loader:
+        for tablename in bulletin.tables:
+            bulletin.to_mongo(tablename=tablename, loader=loader)
+    assert len(clients) == 1
+    assert sorted(clients[0]['seap'].list_collection_names()) == sorted(
+        bulletin.tables
+    )
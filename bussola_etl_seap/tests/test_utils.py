@@ -0,0 +1,80 @@
+"""Tests for utility functions."""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import datetime
+import hashlib
+import numpy as np
+import pandas as pd
+
+from ..utils import (
+    find_bulletin_files, hash_rows, iter_record_chunks, iter_records,
+)
+
+
+def test_find_bulletin_files(tmp_path):
+    """Tests listing bulletins from directories and glob patterns"""
+    for name in ('2020_b.xlsx', '2020_a.xlsx', '2019_a.xlsx', '~$2020_a.xlsx'):
+        (tmp_path / name).touch()
+    (tmp_path / 'notes.txt').touch()
+    assert find_bulletin_files(str(tmp_path)) == [
+        str(tmp_path / name)
+        for name in ('2019_a.xlsx', '2020_a.xlsx', '2020_b.xlsx')
+    ]
+    assert find_bulletin_files(str(tmp_path / '2020*.xlsx')) == [
+        str(tmp_path / name) for name in ('2020_a.xlsx', '2020_b.xlsx')
+    ]
+
+
+def test_hash_rows_compat():
+    """Tests bulk hashes match hashing each row JSON separately"""
+    table = pd.DataFrame({
+        'unidadeId': [1, 2, 3],
+        'unidadeNome': ['Presídio Ary Franco', 'Cadeia Pública/"X"', None],
+        'capacidadeAtual': [968.0, np.nan, 1.123456789012345],
+        'registroData': datetime.date(2020, 8, 11),
+        'registroHora': pd.Timestamp('2020-08-11'),
+    })
+    expected = table.apply(
+        lambda row: hashlib.sha256(
+            row.to_json(orient='records').encode()
+        ).hexdigest(),
+        axis=1,
+    )
+    pd.testing.assert_series_equal(hash_rows(table), expected)
+    numeric = table[['unidadeId', 'capacidadeAtual']]
+    assert hash_rows(numeric).tolist() == [
+        hashlib.sha256(row.to_json(orient='records').encode()).hexdigest()
+        for _, row in numeric.iterrows()
+    ]
+
+
+def test_hash_rows_canonical():
+    """Tests canonical hashes are deterministic and tell rows apart"""
+    table = pd.DataFrame({'unidadeId': [1, 2, 1], 'efetivoReal': [5, 5, 5]})
+    digests = hash_rows(table, compat=False)
+    assert digests[0] == digests[2]
+    assert digests[0] != digests[1]
+    assert digests.tolist() == hash_rows(table, compat=False).tolist()
+
+
+def test_iter_records():
+    """Tests records are converted in chunks to native Python values"""
+    table = pd.DataFrame({
+        'unidadeId': [1, 2, 3],
+        'unidadeTipo': pd.Categorical(['Presídio', None, 'Presídio']),
+        'efetivoReal': pd.array([968, None, 12], dtype='UInt16'),
+        'registroData': pd.Timestamp('2020-08-11'),
+    })
+    chunks = list(iter_record_chunks(table, chunksize=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    records = list(iter_records(table, chunksize=2))
+    assert records == [record for chunk in chunks for record in chunk]
+    assert records[1] == {
+        'unidadeId': 2,
+        'unidadeTipo': None,
+        'efetivoReal': None,
+        'registroData': datetime.datetime(2020, 8, 11),
+    }
+    assert [type(value) for value in records[0].values()] == [
+        int, str, int, datetime.datetime,
+    ]
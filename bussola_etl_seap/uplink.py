@@ -0,0 +1,100 @@
+"""Connection to Anvil apps, through the Anvil Uplink"""
+# pylint: disable=redefined-outer-name,singleton-comparison
+
+import anvil.server
+import anvil.tables
+import datetime
+import log
+import pandas as pd
+from . import utils
+from .export import Checkpoint
+from typing import Any, Optional
+
+
+# errors of lost or slow connections to the app, after which uploads are
+# retried
+TRANSIENT_ERRORS = (
+    anvil.server.RuntimeUnavailableError,
+    anvil.server.TimeoutError,
+    anvil.server.UplinkDisconnectedError,
+)
+
+
+def connect(token: str) -> None:
+    """Connect to the Anvil app with an Uplink token"""
+    log.debug('    Connecting to Anvil App...')
+    anvil.server.connect(token)
+
+
+def get_table(name: str) -> Any:
+    """Get a Data Table of the connected app by its name"""
+    table = getattr(anvil.tables.app_tables, name, False)
+    if table is False:
+        log.error(f"There is no table named '{name}' in this app!")
+        raise AttributeError
+    return table
+
+
+def upload(
+    table: pd.DataFrame,
+    outtable: Any,
+    date: datetime.date,
+    date_col: str,
+    hash_col: str,
+    id_col: str,
+    exist_policy: str = 'ignore',
+    chunksize: int = 500,
+    checkpoint: Optional[Checkpoint] = None,
+) -> None:
+    """Add the rows of a table to a Data Table, in batches
+
+    Rows are told apart by their hashes, and those of rows already uploaded
+    with the same date are handled according to `exist_policy`.
+    """
+    # fetch hashes of records already uploaded for this bulletin date
+    # with a single search, and compare them locally
+    log.debug('    Fetching records already in destination...')
+    existing_hashes = {
+        row[hash_col] for row in outtable.search(**{date_col: date})
+    }
+    duplicated = table[hash_col].isin(existing_hashes)
+    for record_hash, facility_id in zip(
+        table.loc[duplicated, hash_col],
+        table.loc[duplicated, id_col],
+    ):
+        log.debug(
+            f'Record {record_hash} (facility id #' +
+            f'{facility_id}) already exist in destination.'
+        )
+    if duplicated.any() and (exist_policy == 'fail'):
+        log.error(
+            'One or more records already exist in the destination! ' +
+            'Aborting...'
+        )
+        raise ValueError
+    # export new rows in batches to destination DataTable, converting
+    # each batch only when the previous one was sent
+    if exist_policy == 'ignore':
+        new_rows = ~duplicated
+    else:
+        new_rows = pd.Series(True, index=table.index)
+    log.info(f'Starting export of {new_rows.sum()} records...')
+    # batches are taken before skipping duplicates, so that committed
+    # rows can be counted in the whole table
+    for start in range(0, len(table), chunksize):
+        end = start + chunksize
+        records = list(utils.iter_records(
+            table.iloc[start:end].loc[new_rows.iloc[start:end]],
+            chunksize,
+        ))
+        if len(records) > 0:
+            outtable.add_rows(records)
+        if checkpoint is not None:
+            checkpoint.commit(min(end, len(table)) - start)
+    if duplicated.any():
+        log.warn(
+            'Duplicated records were found and handled according ' +
+            'to the policy for existent records. Check Anvil panel or ' +
+            'run this tool again with --debug option to see the repeated' +
+            ' records.'
+        )
@@ -1,8 +1,219 @@
 """Utility functions."""
 # pylint: disable=redefined-outer-name,singleton-comparison
 
+import glob
+import hashlib
+import log
+import numpy as np
+import os
+import pandas as pd
+from typing import (
+    Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence,
+)
+
+try:
+    from pandas._libs.json import ujson_dumps as _json_dumps
+except ImportError:  # pandas < 2.0
+    from pandas._libs.json import dumps as _json_dumps
+
 
 def foo():
     """Example function"""
     # TO-DO
     raise NotImplementedError
+
+
+def find_bulletin_files(
+    path: str,
+    extension: str = '.xlsx',
+) -> List[str]:
+    """List bulletin files in a directory, in a glob pattern or a single path"""
+    if os.path.isdir(path):
+        pattern = os.path.join(path, '*' + extension)
+    elif glob.has_magic(path):
+        pattern = path
+    else:
+        return [path]
+    # skip lock files left behind by open Excel sessions (e.g. '~$file.xlsx')
+    return sorted(
+        _path for _path in glob.glob(pattern)
+        if os.path.isfile(_path)
+        and not os.path.basename(_path).startswith('~$')
+    )
+
+
+def file_sha256(path: str, blocksize: int = 2**20) -> str:
+    """Get the SHA256 hash of the contents of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_rows(
+    table: pd.DataFrame,
+    compat: bool = True,
+) -> pd.Series:
+    """Get the SHA256 hash of every row in a table, serialized in one pass
+
+    In compatibility mode (the default), digests are identical to hashing
+    the JSON of each row as a Series (`row.to_json(orient='records')`), so
+    ids generated by previous versions stay stable. Otherwise, rows are
+    hashed over a canonical text encoding built column by column.
+    """
+    row_jsons: Iterable[str]
+    if compat:
+        # rows of the interleaved array are the same ones `DataFrame.apply`
+        # hands out with axis=1, already upcast to a common dtype
+        row_jsons = (
+            _json_dumps(
+                row,
+                orient='records',
+                double_precision=10,
+                ensure_ascii=True,
+                date_unit='ms',
+                iso_dates=False,
+                default_handler=None,
+                indent=0,
+            )
+            for row in table.to_numpy()
+        )
+    else:
+        row_jsons = _canonical_rows(table)
+    digests = [
+        hashlib.sha256(row_json.encode()).hexdigest()
+        for row_json in row_jsons
+    ]
+    return pd.Series(digests, index=table.index, dtype=object)
+
+
+def _canonical_rows(table: pd.DataFrame) -> List[str]:
+    """Encode table rows as text, converting each column as a whole"""
+    encoded_cols = []
+    for col in table.columns:
+        values = table[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            encoded = values.dt.strftime(r'%Y-%m-%dT%H:%M:%S')
+        else:
+            encoded = values.astype(str)
+        encoded_cols.append(encoded.where(values.notna(), ''))
+    if len(encoded_cols) == 0:
+        return [''] * len(table)
+    # join fields with the ASCII unit separator, unlikely in bulletin texts
+    return encoded_cols[0].str.cat(encoded_cols[1:], sep='\x1f').tolist()
+
+
+def compact_dtypes(
+    table: pd.DataFrame,
+    id_col: str,
+    text_cols: Sequence[str],
+    count_cols: Sequence[str],
+    categories: Optional[Mapping[str, pd.CategoricalDtype]] = None,
+) -> pd.DataFrame:
+    """Convert text columns to categories and counts to small integers
+
+    Text columns with known values should be given fixed `categories`, so
+    that tables of different bulletins can be concatenated as categories.
+    Others get the categories of the values they happen to have.
+    """
+    categories = categories or {}
+    dtypes: Dict[str, Any] = {}
+    for col in table.columns:
+        if col == id_col:
+            dtypes[col] = 'Int32'
+        elif col in categories:
+            values = table[col].dropna()
+            unknown = values[~values.isin(categories[col].categories)]
+            if len(unknown) > 0:
+                log.error(
+                    f"Unexpected values in column '{col}': " +
+                    f"{', '.join(map(str, unknown.unique()))}."
+                )
+                raise ValueError
+            dtypes[col] = categories[col]
+        elif col in text_cols:
+            dtypes[col] = 'category'
+        elif col in count_cols:
+            # counts are expected to fit, but never truncate them
+            if table[col].min() < 0:
+                dtypes[col] = 'Int32'
+            elif table[col].max() > np.iinfo(np.uint16).max:
+                dtypes[col] = 'UInt32'
+            else:
+                dtypes[col] = 'UInt16'
+    return table.astype(dtypes)
+
+
+def expand_dtypes(
+    table: pd.DataFrame,
+    float_cols: Sequence[str] = (),
+) -> pd.DataFrame:
+    """Undo `compact_dtypes`, giving columns the dtypes they are parsed with
+
+    Categories become objects, and nullable integers become NumPy integers,
+    or floats if they are in `float_cols` or have missing values.
+    """
+    dtypes: Dict[str, Any] = {}
+    for col in table.columns:
+        dtype = table[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            dtypes[col] = object
+        elif pd.api.types.is_extension_array_dtype(dtype) and (
+            pd.api.types.is_integer_dtype(dtype)
+        ):
+            if (col in float_cols) or table[col].hasnans:
+                dtypes[col] = 'float64'
+            else:
+                dtypes[col] = 'int64'
+    if len(dtypes) == 0:
+        return table
+    return table.astype(dtypes)
+
+
+def iter_record_chunks(
+    table: pd.DataFrame,
+    chunksize: int = 1000,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Yield the rows of a table as lists of at most `chunksize` records
+
+    Records are dicts of native Python values: numbers come as `int` and
+    `float`, timestamps as `datetime.datetime` and missing values of
+    nullable columns as `None`. Each chunk is only converted when it is
+    requested, so consumers can send the first records while the later
+    ones are not converted yet.
+    """
+    columns = list(table.columns)
+    for start in range(0, len(table), chunksize):
+        chunk = table.iloc[start:start + chunksize]
+        values = [_native_values(column) for _, column in chunk.items()]
+        yield [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def iter_records(
+    table: pd.DataFrame,
+    chunksize: int = 1000,
+) -> Iterator[Dict[str, Any]]:
+    """Yield the rows of a table as records, converting them in chunks"""
+    for chunk in iter_record_chunks(table, chunksize):
+        yield from chunk
+
+
+def _native_values(column: pd.Series) -> List[Any]:
+    """Convert a column to a list of native Python values"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # convert each category once, then look values up by their codes
+        categories = _native_values(column.cat.categories.to_series())
+        return [
+            categories[code] if code >= 0 else None
+            for code in column.cat.codes.tolist()
+        ]
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return [
+            None if value is pd.NaT else value
+            for value in column.dt.to_pydatetime()
+        ]
+    if pd.api.types.is_extension_array_dtype(column):
+        # nullable columns hold `pd.NA`, which can't be serialized
+        return column.to_numpy(dtype=object, na_value=None).tolist()
+    return column.tolist()
@@ -1,23 +1,234 @@
 """Sample integration test module using pytest-describe and expecter."""
 # pylint: disable=redefined-outer-name,unused-variable,expression-not-assigned
 
-import sys, os
+import json
+import os
+import shutil
+import subprocess
+import sys
 from click.testing import CliRunner
 
-from bussola_etl_seap.cli import etl
+from bussola_etl_seap import bussola_etl_seap
+from bussola_etl_seap.archive import BulletinArchive
+from bussola_etl_seap.cli import _get_sinks, etl
 
 
 TESTS_PATH = os.path.dirname(os.path.realpath(__file__))
-sys.path.insert(0, os.path.relpath('../bussola_etl_seap', TESTS_PATH))
+EXAMPLE_FILE = os.path.join(
+    os.path.dirname(TESTS_PATH), 'data', 'input', 'example.xlsx',
+)
 
 
-def test_etl_localfile():
+def test_etl_localfile(tmp_path):
     """Teste da função de ETL a partir de um arquivo local"""
 
     runner = CliRunner()
-    example_file = os.path.relpath('../data/input/example.xlsx', TESTS_PATH)
+    output_file = str(tmp_path / '[YYYY][MM][DD]_SEAPRJ.csv')
     result = runner.invoke(
-        etl, [example_file, '--date', '2020-08-11', '--verbosity', 3]
+        etl,
+        [
+            '-i', EXAMPLE_FILE,
+            '--date', '2020-08-11',
+            '-e', 'occupation',
+            '-o', output_file,
+            '--verbosity', 0,
+        ],
     )
     assert result.exit_code == 0
-    assert result.output == example_file  # TO-DO: change assertion
+    assert os.path.isfile(tmp_path / '20200811_SEAPRJ_occupation.csv')
+
+
+def test_etl_directory(tmp_path):
+    """Teste da função de ETL a partir de um diretório com vários boletins"""
+
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    for name in ('bulletin_a.xlsx', 'bulletin_b.xlsx'):
+        shutil.copy(EXAMPLE_FILE, input_dir / name)
+    output_dir = tmp_path / 'output'
+    output_dir.mkdir()
+    runner = CliRunner()
+    result = runner.invoke(
+        etl,
+        [
+            '-i', str(input_dir),
+            '--workers', 2,
+            '-e', 'facilities',
+            '-o', str(output_dir / '[YYYY][MM][DD]_SEAPRJ.csv'),
+            '--if-exists', 'upsert',
+            '--verbosity', 0,
+        ],
+    )
+    assert result.exit_code == 0
+    assert sorted(os.listdir(output_dir)) == [
+        '20200811_SEAPRJ_facilities.csv',
+        '20200811_SEAPRJ_facilities.csv.keys',
+    ]
+    # both bulletins have the same date, so rows are written only once
+    with open(
+        output_dir / '20200811_SEAPRJ_facilities.csv', encoding='utf-8',
+    ) as outfile:
+        assert len(outfile.readlines()) == 1 + 50
+
+
+def test_etl_directory_with_broken_file(tmp_path):
+    """Teste de que um boletim inválido não impede a carga dos demais"""
+
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    (input_dir / 'bulletin_a.xlsx').write_bytes(b'not a workbook')
+    shutil.copy(EXAMPLE_FILE, input_dir / 'bulletin_b.xlsx')
+    runner = CliRunner()
+    result = runner.invoke(
+        etl,
+        [
+            '-i', str(input_dir),
+            '--workers', 2,
+            '-e', 'facilities',
+            '-o', str(tmp_path / '[YYYY][MM][DD]_SEAPRJ.csv'),
+            '--verbosity', 0,
+        ],
+    )
+    # the run fails only after exporting every other bulletin
+    assert isinstance(result.exception, RuntimeError)
+    assert os.path.isfile(tmp_path / '20200811_SEAPRJ_facilities.csv')
+
+
+def test_etl_date_with_many_files(tmp_path):
+    """Teste de erro ao informar uma única data para vários boletins"""
+
+    for name in ('bulletin_a.xlsx', 'bulletin_b.xlsx'):
+        shutil.copy(EXAMPLE_FILE, tmp_path / name)
+    runner = CliRunner()
+    result = runner.invoke(
+        etl, ['-i', str(tmp_path), '--date', '2020-08-11', '--verbosity', 0],
+    )
+    assert result.exit_code == 2
+
+
+def test_etl_profile(tmp_path):
+    """Teste do registro de tempo e memória de cada etapa do processamento"""
+
+    profile_file = tmp_path / 'profile.jsonl'
+    runner = CliRunner()
+    result = runner.invoke(
+        etl,
+        [
+            '-i', EXAMPLE_FILE,
+            '-e', 'facilities',
+            '-o', str(tmp_path / '[YYYY][MM][DD]_SEAPRJ.csv'),
+            '--profile', str(profile_file),
+            '--verbosity', 0,
+        ],
+    )
+    assert result.exit_code == 0
+    with open(profile_file, encoding='utf-8') as infile:
+        records = [json.loads(line) for line in infile]
+    stages = {record['stage'] for record in records}
+    assert {'read', 'names', 'export:file:facilities'} <= stages
+    assert all(record['date'] == '2020-08-11T00:00:00' for record in records)
+
+
+def test_etl_archive(tmp_path):
+    """Teste do armazenamento dos boletins em um arquivo histórico"""
+
+    archive_file = tmp_path / 'archive.sqlite'
+    runner = CliRunner()
+    result = runner.invoke(
+        etl,
+        [
+            '-i', EXAMPLE_FILE,
+            '--to-archive', str(archive_file),
+            '--verbosity', 0,
+        ],
+    )
+    assert result.exit_code == 0
+    with BulletinArchive(str(archive_file)) as archive:
+        assert len(archive.dates) == 1
+        assert len(archive.facility_series(8)) == 1
+
+
+def test_etl_manifest(tmp_path, monkeypatch):
+    """Teste da execução incremental, sem repetir boletins já carregados"""
+
+    manifest_file = tmp_path / 'manifest.json'
+    output_file = str(tmp_path / '[YYYY][MM][DD]_SEAPRJ.csv')
+    arguments = [
+        '-i', EXAMPLE_FILE,
+        '-e', 'facilities',
+        '-o', output_file,
+        '--manifest', str(manifest_file),
+        '--verbosity', 0,
+    ]
+    runner = CliRunner()
+    result = runner.invoke(etl, arguments)
+    assert result.exit_code == 0
+    assert os.path.isfile(manifest_file)
+
+    # bulletins loaded already are not parsed again
+    parsed = []
+
+    def fail_parsing(self, input_file, *args, **kwargs):
+        parsed.append(input_file)
+        raise AssertionError('Bulletin should have been skipped')
+
+    monkeypatch.setattr(
+        bussola_etl_seap.SEAPBulletin, '__init__', fail_parsing,
+    )
+    result = runner.invoke(etl, arguments)
+    assert result.exit_code == 0
+    assert parsed == []
+    # new destinations are still loaded
+    result = runner.invoke(
+        etl, arguments + ['--to-archive', str(tmp_path / 'archive.sqlite')],
+    )
+    assert parsed == [EXAMPLE_FILE]
+    assert isinstance(result.exception, RuntimeError)
+    # as are bulletins dated otherwise
+    parsed.clear()
+    result = runner.invoke(etl, arguments + ['--date', '2020-08-18'])
+    assert parsed == [EXAMPLE_FILE]
+
+
+def test_anvil_sinks_per_app(monkeypatch):
+    """Teste de que tabelas de mesmo nome em apps Anvil diferentes não se
+    confundem no manifesto"""
+
+    def anvil_sinks(token):
+        return list(_get_sinks(
+            output_file=None,
+            partition=False,
+            compression=None,
+            to_anvil_table='imprisoned',
+            anvil_token=token,
+            to_mongo=None,
+            mongo_loader=None,
+            archive=None,
+            date_column='data',
+            if_exists='append',
+        ))
+
+    monkeypatch.setenv('ANVIL_TOKEN', 'token-a')
+    sinks_a = anvil_sinks('token-a')
+    assert anvil_sinks(None) == sinks_a
+    assert anvil_sinks('token-b') != sinks_a
+    assert all('token' not in sink for sink in sinks_a)
+    assert sinks_a[0].startswith('anvil:')
+    assert sinks_a[0].endswith('/imprisoned')
+
+
+def test_startup_without_clients():
+    """Teste de que o CLI inicia sem importar os clientes de Anvil e MongoDB"""
+
+    result = subprocess.run(
+        [
+            sys.executable, '-c',
+            'import sys; from bussola_etl_seap.cli import etl; ' +
+            'print(*sys.modules)',
+        ],
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    modules = {name.split('.')[0] for name in result.stdout.split()}
+    assert not modules & {'anvil', 'pymongo', 'openpyxl', 'pkg_resources'}